@@ -0,0 +1,57 @@
+#
+# oci-opentelemetry benchmarks.
+#
+# Copyright (c) 2024, Oracle and/or its affiliates. All rights reserved.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl.
+
+"""
+Exported data points, payload bytes and assembly time of high-frequency metric events (one data point per
+second per series) without pre-aggregation and with summary / histogram aggregation.  Aggregated counts and
+sums are checked against the raw data points.
+
+    python benchmarks/bench_aggregation.py [event_count] [datapoints_per_event]
+"""
+
+import sys
+
+from common import load_function, time_call
+from payloads import metric_events
+
+
+def data_points(metrics_data):
+
+    return [data_point
+            for resource_metrics in metrics_data.resource_metrics
+            for scope_metrics in resource_metrics.scope_metrics
+            for metric in scope_metrics.metrics
+            for data_point in getattr(metric, metric.WhichOneof('data')).data_points]
+
+
+def main(event_count: int, datapoints_per_event: int):
+
+    metrics_func = load_function('oci-metrics-otel')
+    events = metric_events(event_count, datapoints_per_event=datapoints_per_event)
+    raw_values = [datapoint['value'] for event in events for datapoint in event['datapoints']]
+
+    print(f'metrics / {event_count} events / {len(raw_values)} datapoints / '
+          f'window {metrics_func.OTEL_METRIC_AGGREGATION_WINDOW_SECONDS}s')
+
+    for aggregation in ['none', 'summary', 'histogram']:
+        metrics_func.OTEL_METRIC_AGGREGATION = aggregation
+        seconds, metrics_data = time_call(lambda: metrics_func.assemble_otel_metrics_data(events))
+        points = data_points(metrics_data)
+
+        if aggregation != 'none':
+            assert sum(point.count for point in points) == len(raw_values)
+            assert abs(sum(point.sum for point in points) - sum(raw_values)) < 1e-6 * len(raw_values)
+
+        if aggregation == 'histogram':
+            assert all(sum(point.bucket_counts) == point.count for point in points)
+
+        print(f'  {aggregation:<9} {len(points):>8} data points  {metrics_data.ByteSize():>12,} bytes  '
+              f'{seconds * 1000:8.2f} ms')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 60)
@@ -0,0 +1,60 @@
+#
+# oci-opentelemetry benchmarks.
+#
+# Copyright (c) 2024, Oracle and/or its affiliates. All rights reserved.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl.
+
+"""
+Assembly time with and without the attribute cache, on a warm cache as in a hot function container.
+The assembled payloads must be identical.
+
+    python benchmarks/bench_attribute_cache.py [event_count]
+"""
+
+import sys
+
+from common import load_function, time_call
+from payloads import audit_log_events, metric_events, vcn_flow_log_events
+
+
+def compare(label, func_module, assemble, event_count):
+
+    func_module.OTEL_ATTRIBUTE_CACHE_SIZE = 0
+    uncached_seconds, uncached = time_call(assemble)
+
+    func_module.OTEL_ATTRIBUTE_CACHE_SIZE = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    func_module.attribute_cache_stats.update(hits=0, misses=0)
+    cached_seconds, cached = time_call(assemble)
+
+    assert cached == uncached
+
+    stats = func_module.attribute_cache_stats
+    print(f'{label}')
+    print(f'  uncached  {uncached_seconds * 1e6 / event_count:8.2f} us/event')
+    print(f'  cached    {cached_seconds * 1e6 / event_count:8.2f} us/event  '
+          f'(hit ratio {stats["hits"] / max(stats["hits"] + stats["misses"], 1):.2f})')
+    print(f'  speedup   {uncached_seconds / cached_seconds:8.2f}x')
+
+
+def main(event_count: int):
+
+    metrics_func = load_function('oci-metrics-otel')
+    events = metric_events(event_count, datapoints_per_event=5)
+    compare(f'metrics / {event_count} events', metrics_func,
+            lambda: metrics_func.assemble_otel_metrics_data(events).SerializeToString(), event_count)
+
+    logs_func = load_function('oci-log-otel')
+    logs_func.RAISE_MISSING_MAP_KEY = False
+
+    for label, events in [('vcn flow logs', vcn_flow_log_events(event_count)),
+                          ('audit logs', audit_log_events(event_count))]:
+
+        for encoder in ['protobuf', 'direct']:
+            logs_func.OTEL_JSON_ENCODER = encoder
+            compare(f'{label} / {encoder} encoder / {event_count} events', logs_func,
+                    lambda: [chunk if isinstance(chunk, str) else chunk.SerializeToString()
+                             for chunk, _ in logs_func.assemble_otel_chunks(events)], event_count)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
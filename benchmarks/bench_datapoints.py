@@ -0,0 +1,101 @@
+#
+# oci-opentelemetry benchmarks.
+#
+# Copyright (c) 2024, Oracle and/or its affiliates. All rights reserved.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl.
+
+"""
+Datapoint conversion of metric events carrying many datapoints: the previous one-NumberDataPoint-at-a-time
+conversion against the bulk path, with the lookup table and (when numpy is installed) vectorized timestamps.
+Datapoints are coalesced (COALESCE_METRIC_DATAPOINTS) so that each event converts as one batch.  Timestamp normalization alone is timed as well.
+
+    python benchmarks/bench_datapoints.py [event_count] [datapoints_per_event]
+"""
+
+import os
+import sys
+
+os.environ['COALESCE_METRIC_DATAPOINTS'] = 'True'
+
+from opentelemetry.proto.metrics.v1.metrics_pb2 import Gauge, Metric, NumberDataPoint
+
+from common import load_function, time_call
+from payloads import metric_events
+
+
+def multiply_unix_time_to_nano(timestamp_int: int):
+    """
+    The normalization used before the lookup table
+    """
+
+    while timestamp_int < 1000000000000000000:
+        timestamp_int *= 10
+
+    return timestamp_int
+
+
+def per_point_metrics(metrics_func, event_values: dict):
+    """
+    The conversion used before the bulk path
+    """
+
+    data_points = []
+    for oci_datapoint in event_values['datapoints']:
+        data_point = NumberDataPoint(attributes=metrics_func.assemble_otel_attributes(
+            oci_datapoint, metrics_func.OTEL_DATAPOINT_ATTR_MAP))
+        data_point.time_unix_nano = multiply_unix_time_to_nano(oci_datapoint.get('timestamp'))
+        data_point.as_double = float(oci_datapoint.get('value'))
+        data_points.append(data_point)
+
+    data_points.sort(key=lambda data_point: data_point.time_unix_nano)
+    return [Metric(name=event_values['name'], description=event_values['displayName'], unit=event_values['unit'],
+                   gauge=Gauge(data_points=data_points))]
+
+
+def main(event_count: int, datapoints_per_event: int):
+
+    metrics_func = load_function('oci-metrics-otel')
+    events = metric_events(event_count, datapoints_per_event=datapoints_per_event)
+    event_values = [metrics_func.resolve_event_values(event) for event in events]
+    datapoint_count = event_count * datapoints_per_event
+
+    def bulk(min_datapoints):
+        metrics_func.OTEL_VECTORIZE_MIN_DATAPOINTS = min_datapoints
+        return [metrics_func.assemble_otel_metrics(event, values) for event, values in zip(events, event_values)]
+
+    per_point_seconds, per_point = time_call(lambda: [per_point_metrics(metrics_func, values) for values in event_values])
+    table_seconds, table = time_call(lambda: bulk(1 << 62))
+    results = [('per point (previous)', per_point_seconds), ('bulk, lookup table', table_seconds)]
+    assert table == per_point
+
+    if metrics_func.numpy is not None:
+        numpy_seconds, vectorized = time_call(lambda: bulk(64))
+        results.append(('bulk, numpy', numpy_seconds))
+        assert vectorized == per_point
+
+    print(f'metrics / {event_count} events x {datapoints_per_event} datapoints / '
+          f'numpy installed {metrics_func.numpy is not None}')
+    for label, seconds in results:
+        print(f'  {label:<22} {seconds * 1e9 / datapoint_count:8.1f} ns/datapoint  '
+              f'speedup {per_point_seconds / seconds:5.2f}x')
+
+    timestamps = [datapoint['timestamp'] for event in events for datapoint in event['datapoints']]
+    loop_seconds, expected = time_call(lambda: [multiply_unix_time_to_nano(timestamp) for timestamp in timestamps])
+    table_seconds, adjusted = time_call(lambda: [metrics_func.adjust_unix_time_to_nano(timestamp)
+                                                 for timestamp in timestamps])
+    assert adjusted == expected
+
+    print(f'timestamps / {len(timestamps)}')
+    print(f'  {"multiply loop":<22} {loop_seconds * 1e9 / len(timestamps):8.1f} ns/timestamp')
+    print(f'  {"lookup table":<22} {table_seconds * 1e9 / len(timestamps):8.1f} ns/timestamp')
+
+    if metrics_func.numpy is not None:
+        metrics_func.OTEL_VECTORIZE_MIN_DATAPOINTS = 64
+        numpy_seconds, adjusted = time_call(lambda: metrics_func.adjust_unix_times_to_nano(timestamps))
+        assert adjusted == expected
+        print(f'  {"numpy":<22} {numpy_seconds * 1e9 / len(timestamps):8.1f} ns/timestamp')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 2000)
@@ -0,0 +1,40 @@
+#
+# oci-opentelemetry benchmarks.
+#
+# Copyright (c) 2024, Oracle and/or its affiliates. All rights reserved.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl.
+
+"""
+Compares OTLP/JSON and OTLP/protobuf serialize time and payload bytes for assembled MetricsData / LogsData.
+
+    python benchmarks/bench_encoding.py [event_count]
+"""
+
+import sys
+
+from common import load_function, time_call
+from payloads import metric_events, vcn_flow_log_events
+
+
+def compare_encodings(label, func_module, message):
+
+    print(f'{label}')
+    for encoding in ['json', 'protobuf']:
+        func_module.OTEL_EXPORT_ENCODING = encoding
+        seconds, (payload, content_type) = time_call(lambda: func_module.serialize_otel_message(message))
+        print(f'  {encoding:<9} {seconds * 1000:9.2f} ms  {len(payload):>12,} bytes  {content_type}')
+
+
+def main(event_count: int):
+
+    metrics_func = load_function('oci-metrics-otel')
+    metrics_data = metrics_func.assemble_otel_metrics_data(metric_events(event_count, datapoints_per_event=5))
+    compare_encodings(f'metrics / {event_count} events', metrics_func, metrics_data)
+
+    logs_func = load_function('oci-log-otel')
+    logs_data = logs_func.assemble_otel_logs_data(vcn_flow_log_events(event_count))
+    compare_encodings(f'logs / {event_count} events', logs_func, logs_data)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,47 @@
+#
+# oci-opentelemetry benchmarks.
+#
+# Copyright (c) 2024, Oracle and/or its affiliates. All rights reserved.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl.
+
+"""
+Compares one get_dictionary_value walk per key against the single-pass get_dictionary_values on deep
+audit log events.  The key set mixes shallow keys, deep keys and keys that are not present at all.
+
+    python benchmarks/bench_extraction.py [event_count] [nesting_depth]
+"""
+
+import sys
+
+from common import load_function, time_call
+from payloads import audit_log_events
+
+TARGET_KEYS = ['oracle', 'id', 'type', 'time', 'compartmentId', 'principalId', 'resourceId', 'vnicId', 'subnetId']
+
+
+def main(event_count: int, nesting_depth: int):
+
+    logs_func = load_function('oci-log-otel')
+    events = audit_log_events(event_count, nesting_depth=nesting_depth)
+
+    def per_key():
+        return [{key: logs_func.get_dictionary_value(event, key) for key in TARGET_KEYS} for event in events]
+
+    def single_pass():
+        return [logs_func.get_dictionary_values(event, TARGET_KEYS) for event in events]
+
+    per_key_seconds, per_key_values = time_call(per_key)
+    single_pass_seconds, single_pass_values = time_call(single_pass)
+
+    # same first-match results (missing / falsy keys are simply absent from the single-pass result)
+    assert [{k: v for k, v in values.items() if v} for values in per_key_values] == single_pass_values
+
+    print(f'audit events {event_count} / nesting depth {nesting_depth} / keys {len(TARGET_KEYS)}')
+    print(f'  per-key walks  {per_key_seconds * 1e6 / event_count:8.2f} us/event')
+    print(f'  single pass    {single_pass_seconds * 1e6 / event_count:8.2f} us/event')
+    print(f'  speedup        {per_key_seconds / single_pass_seconds:8.2f}x')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 6)
@@ -0,0 +1,81 @@
+#
+# oci-opentelemetry benchmarks.
+#
+# Copyright (c) 2024, Oracle and/or its affiliates. All rights reserved.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl.
+
+"""
+Exports assembled batches over OTLP/gRPC to the in-process stub collector, timing the first export (channel
+set-up) against later exports that reuse the module-level channel.  Also checks that UNAVAILABLE is retried
+and that chunks above OTEL_EXPORT_GRPC_MAX_MESSAGE_BYTES are rejected without a retry.
+
+    python benchmarks/bench_grpc.py [event_count] [invocations]
+"""
+
+import os
+import sys
+import time
+
+os.environ['OTEL_EXPORT_SPOOL_MAX_BYTES'] = '0'
+os.environ['OTEL_EXPORT_BACKOFF_SECONDS'] = '0.01'
+os.environ['LOGGING_LEVEL'] = 'WARNING'
+
+from common import load_function
+from payloads import metric_events, vcn_flow_log_events
+from stub_collector import StubGrpcCollector
+
+
+def load_grpc_function(function_dir: str, endpoint: str):
+
+    os.environ['OTEL_EXPORT_PROTOCOL'] = 'grpc'
+    os.environ['OTEL_COLLECTOR_GRPC_ENDPOINT'] = endpoint
+    return load_function(function_dir)
+
+
+def time_exports(label, func_module, message, invocations: int):
+
+    durations = []
+    for _ in range(invocations):
+        start = time.perf_counter()
+        results = func_module.export_otel_message(message)
+        durations.append(time.perf_counter() - start)
+        assert all(result['success'] for result in results)
+
+    warm = sorted(durations[1:])
+    print(f'{label}')
+    print(f'  first export (channel set-up)   {durations[0] * 1000:8.2f} ms')
+    print(f'  warm exports, median           {warm[len(warm) // 2] * 1000:8.2f} ms  '
+          f'({results[0]["bytes"]:,} bytes / chunk, {len(results)} chunks)')
+
+
+def main(event_count: int, invocations: int):
+
+    with StubGrpcCollector() as collector:
+        metrics_func = load_grpc_function('oci-metrics-otel', collector.endpoint)
+        metrics_data = metrics_func.assemble_otel_metrics_data(metric_events(event_count, datapoints_per_event=5))
+        time_exports(f'metrics / {event_count} events', metrics_func, metrics_data, invocations)
+
+        logs_func = load_grpc_function('oci-log-otel', collector.endpoint)
+        logs_data = logs_func.assemble_otel_logs_data(vcn_flow_log_events(event_count))
+        time_exports(f'logs / {event_count} events', logs_func, logs_data, invocations)
+
+        assert collector.requests == collector.calls
+        print(f'collector / requests {collector.requests} / bytes {collector.request_bytes:,}')
+
+    with StubGrpcCollector(fail_first=2) as collector:
+        logs_func = load_grpc_function('oci-log-otel', collector.endpoint)
+        result = logs_func.export_otel_chunk(0, logs_data, event_count)
+        assert result['success'] and result['retries'] == 2 and collector.requests == 1
+        print(f'retry / UNAVAILABLE twice / delivered after {result["retries"]} retries')
+
+    with StubGrpcCollector() as collector:
+        os.environ['OTEL_EXPORT_GRPC_MAX_MESSAGE_BYTES'] = '1024'
+        logs_func = load_grpc_function('oci-log-otel', collector.endpoint)
+        result = logs_func.export_otel_chunk(0, logs_data, event_count)
+        assert not result['success'] and result['retries'] == 0 and collector.calls == 0
+        print(f'message size limit / rejected without retry / {result["error"]}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 20)
@@ -0,0 +1,191 @@
+#
+# oci-opentelemetry benchmarks.
+#
+# Copyright (c) 2024, Oracle and/or its affiliates. All rights reserved.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl.
+
+"""
+Runs each function's handler() end-to-end on synthetic payloads: the OTEL functions export to the local HTTP
+stub collector and tag-enrich searches the stub Search client.  Every scenario runs in its own process so
+that peak RSS is its own.  Reported per scenario: events/sec over the warm invocations, latency percentiles
+of the handler and its stages, peak RSS and request bytes sent per invocation.
+
+    python benchmarks/bench_handlers.py [--events N] [--invocations N] [--depth N] [scenario ...]
+"""
+
+import argparse
+import concurrent.futures
+import functools
+import io
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+import types
+
+from common import invoke_context, load_function, percentile
+from payloads import audit_log_events, metric_events, service_log_events, vcn_flow_log_events
+from stub_collector import StubHttpCollector
+
+# scenario: (function directory, payload generator(event_count, depth), environment)
+
+SCENARIOS = {
+    'metrics': ('oci-metrics-otel',
+                lambda count, depth: metric_events(count, datapoints_per_event=10, dimension_count=depth), {}),
+    'metrics-protobuf-gzip': ('oci-metrics-otel',
+                              lambda count, depth: metric_events(count, datapoints_per_event=10, dimension_count=depth),
+                              {'OTEL_EXPORT_ENCODING': 'protobuf', 'OTEL_EXPORT_COMPRESSION': 'gzip'}),
+    'audit-logs': ('oci-log-otel', lambda count, depth: audit_log_events(count, nesting_depth=depth), {}),
+    'service-logs': ('oci-log-otel', lambda count, depth: service_log_events(count, nesting_depth=depth), {}),
+    'vcn-flow-logs': ('oci-log-otel', lambda count, depth: vcn_flow_log_events(count), {}),
+    'vcn-flow-logs-direct-gzip': ('oci-log-otel', lambda count, depth: vcn_flow_log_events(count),
+                                  {'OTEL_JSON_ENCODER': 'direct', 'OTEL_EXPORT_COMPRESSION': 'gzip'}),
+    'tag-enrich': ('oci-tag-enrich', lambda count, depth: audit_log_events(count, nesting_depth=depth), {}),
+}
+
+# module functions timed per call.  Recursive functions are left out: the wrapper would time every level.
+
+STAGES = {
+    'oci-metrics-otel': ['assemble_otel_metrics_data', 'chunk_otel_metrics_data', 'serialize_otel_message',
+                         'compress_otel_payload', 'send_to_otel_collector'],
+    'oci-log-otel': ['assemble_otel_chunks', 'serialize_otel_message', 'compress_otel_payload',
+                     'send_to_otel_collector'],
+    'oci-tag-enrich': ['assemble_event_tags', 'retrieve_ocids_tags', 'position_tags_on_event'],
+}
+
+
+def time_stages(func_module, stage_names: list):
+    """
+    Replaces each named module function with a wrapper recording its duration.  handler() looks the
+    functions up as module globals, so the wrappers are picked up without changes to the function.
+    Generators are drained inside the wrapper so that their work is counted.
+    :return: dictionary of {stage name: list of seconds}
+    """
+
+    timings = {name: [] for name in stage_names}
+
+    def wrap(name, stage_function):
+
+        @functools.wraps(stage_function)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = stage_function(*args, **kwargs)
+                if isinstance(result, types.GeneratorType):
+                    result = list(result)
+                return result
+            finally:
+                timings[name].append(time.perf_counter() - start)
+
+        return timed
+
+    for name in stage_names:
+        setattr(func_module, name, wrap(name, getattr(func_module, name)))
+
+    return timings
+
+
+def peak_rss_bytes():
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def run_scenario(name: str, event_count: int, invocations: int, depth: int):
+    """
+    Runs in a fresh process.  One warm-up invocation is made before measuring, as on a warm container.
+    """
+
+    function_dir, generate_events, environment = SCENARIOS[name]
+    os.environ.update({'LOGGING_LEVEL': 'ERROR', 'OTEL_EXPORT_SPOOL_MAX_BYTES': '0',
+                       'RAISE_MISSING_MAP_KEY': 'False'})
+    os.environ.update(environment)
+
+    events = generate_events(event_count, depth)
+    body = json.dumps(events).encode()
+
+    with StubHttpCollector() as collector:
+
+        search_client = None
+        if function_dir == 'oci-tag-enrich':
+            from stub_search import StubSearchClient, load_tag_enrich_function
+            search_client = StubSearchClient()
+            func_module = load_tag_enrich_function(search_client)
+        else:
+            os.environ['OTEL_COLLECTOR_METRICS_API_ENDPOINT'] = collector.url('/v1/metrics')
+            os.environ['OTEL_COLLECTOR_LOGS_API_ENDPOINT'] = collector.url('/v1/logs')
+            func_module = load_function(function_dir)
+
+        ctx = invoke_context(name)
+        func_module.handler(ctx, io.BytesIO(body))
+
+        timings = time_stages(func_module, STAGES[function_dir])
+        collector.requests = collector.request_bytes = 0
+        if search_client:
+            search_client.calls = 0
+        handler_seconds = []
+        response_bytes = 0
+
+        for _ in range(invocations):
+            start = time.perf_counter()
+            handler_response = func_module.handler(ctx, io.BytesIO(body))
+            handler_seconds.append(time.perf_counter() - start)
+            if handler_response is not None:
+                response_bytes += len(handler_response.body_bytes())
+
+    # the OTEL handlers log export errors rather than raising them
+
+    if search_client is None and collector.requests < invocations:
+        raise RuntimeError(f'{name} / {collector.requests} requests reached the collector in {invocations} '
+                           f'invocations, see the function log')
+
+    timings['handler'] = handler_seconds
+    return {
+        'events_per_second': event_count * invocations / sum(handler_seconds),
+        'payload_bytes': len(body),
+        'wire_bytes': (response_bytes if search_client else collector.request_bytes) / invocations,
+        'requests': (search_client.calls if search_client else collector.requests) / invocations,
+        'peak_rss_bytes': peak_rss_bytes(),
+        'stages': {stage: [len(seconds)] + [percentile(seconds, fraction) * 1000 for fraction in (0.5, 0.95, 0.99)]
+                   for stage, seconds in timings.items() if seconds},
+    }
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='handler() end-to-end benchmarks')
+    parser.add_argument('scenarios', nargs='*', default=list(SCENARIOS), help=', '.join(SCENARIOS))
+    parser.add_argument('--events', type=int, default=2000, help='events per invocation')
+    parser.add_argument('--invocations', type=int, default=10, help='measured (warm) invocations per scenario')
+    parser.add_argument('--depth', type=int, default=4,
+                        help='audit / service log nesting depth and metric dimension count')
+    args = parser.parse_args()
+
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f'unknown scenario {unknown}')
+
+    print(f'{args.events} events / {args.invocations} invocations / depth {args.depth}')
+
+    for name in args.scenarios:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=1,
+                                                    mp_context=multiprocessing.get_context('spawn')) as executor:
+            try:
+                result = executor.submit(run_scenario, name, args.events, args.invocations, args.depth).result()
+            except ImportError as ex:
+                print(f'\n{name}\n  skipped / {ex}')
+                continue
+
+        print(f'\n{name}')
+        print(f'  events/sec {result["events_per_second"]:12,.0f}   '
+              f'payload {result["payload_bytes"]:,} bytes   '
+              f'sent {result["wire_bytes"]:,.0f} bytes / {result["requests"]:.1f} requests per invocation   '
+              f'peak RSS {result["peak_rss_bytes"] / 2 ** 20:,.1f} MiB')
+        print(f'  {"stage":<30} {"calls":>7} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9}')
+        for stage, (calls, p50, p95, p99) in result['stages'].items():
+            print(f'  {stage:<30} {calls:>7} {p50:>9.3f} {p95:>9.3f} {p99:>9.3f}')
+
+
+if __name__ == '__main__':
+    main()
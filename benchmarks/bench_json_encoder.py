@@ -0,0 +1,45 @@
+#
+# oci-opentelemetry benchmarks.
+#
+# Copyright (c) 2024, Oracle and/or its affiliates. All rights reserved.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl.
+
+"""
+OCI events to OTLP/JSON request body in the log function: assembling LogsData and converting it with
+MessageToDict, against the direct encoder.  The two bodies must be byte-identical.
+
+    python benchmarks/bench_json_encoder.py [event_count]
+"""
+
+import sys
+
+from common import load_function, time_call
+from payloads import audit_log_events, vcn_flow_log_events
+
+
+def main(event_count: int):
+
+    logs_func = load_function('oci-log-otel')
+    logs_func.OTEL_EXPORT_MAX_CHUNK_BYTES = 1 << 40
+    logs_func.RAISE_MISSING_MAP_KEY = False
+
+    def encode(encoder, events):
+        logs_func.OTEL_JSON_ENCODER = encoder
+        return [logs_func.serialize_otel_message(chunk)[0] for chunk, _ in logs_func.assemble_otel_chunks(events)]
+
+    for label, events in [('vcn flow logs', vcn_flow_log_events(event_count)),
+                          ('audit logs', audit_log_events(event_count))]:
+
+        protobuf_seconds, protobuf_bodies = time_call(lambda: encode('protobuf', events))
+        direct_seconds, direct_bodies = time_call(lambda: encode('direct', events))
+
+        assert protobuf_bodies == direct_bodies
+
+        print(f'{label} / {event_count} events / {sum(len(body) for body in direct_bodies):,} bytes')
+        print(f'  protobuf + MessageToDict  {protobuf_seconds * 1e6 / event_count:8.2f} us/event')
+        print(f'  direct                    {direct_seconds * 1e6 / event_count:8.2f} us/event')
+        print(f'  speedup                   {protobuf_seconds / direct_seconds:8.2f}x')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
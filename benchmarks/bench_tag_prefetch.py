@@ -0,0 +1,75 @@
+#
+# oci-opentelemetry benchmarks.
+#
+# Copyright (c) 2024, Oracle and/or its affiliates. All rights reserved.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl.
+
+"""
+Cold-cache tag enrichment of a payload with many distinct OCIDs against the stub Search client with injected
+latency: one lookup at a time (TAG_SEARCH_MAX_WORKERS=1, TAG_SEARCH_BATCH_SIZE=1) against the concurrent
+prefetch, the prefetch under TAG_SEARCH_RATE_LIMIT and batched queries, including results spread over several
+pages.  The tagged payloads must be identical.
+
+    python benchmarks/bench_tag_prefetch.py [distinct_ocids] [latency_ms]
+"""
+
+import copy
+import json
+import os
+import sys
+import time
+
+os.environ['LOGGING_LEVEL'] = 'WARNING'
+
+from payloads import vcn_flow_log_events
+from stub_search import StubSearchClient, load_tag_enrich_function
+
+
+def enrich(events, max_workers: int, rate_limit: float, latency_seconds: float, batch_size: int = 1,
+           page_size: int = 0):
+    """
+    :return: tuple of (seconds, search calls, tagged events) on a freshly loaded function, so the tag cache is cold
+    """
+
+    os.environ['TAG_SEARCH_MAX_WORKERS'] = str(max_workers)
+    os.environ['TAG_SEARCH_RATE_LIMIT'] = str(rate_limit)
+    os.environ['TAG_SEARCH_BATCH_SIZE'] = str(batch_size)
+    search_client = StubSearchClient(latency_seconds=latency_seconds, page_size=page_size)
+    tag_enrich_func = load_tag_enrich_function(search_client)
+
+    events = copy.deepcopy(events)
+    start = time.perf_counter()
+    tag_enrich_func.add_tags_to_payload(events)
+    return time.perf_counter() - start, search_client.calls, events
+
+
+def main(distinct_ocids: int, latency_ms: float):
+
+    events = vcn_flow_log_events(distinct_ocids * 10, log_count=distinct_ocids)
+    latency_seconds = latency_ms / 1000
+    print(f'{len(events)} events / {distinct_ocids} distinct OCIDs / search latency {latency_ms:.0f} ms')
+
+    serial_seconds, serial_calls, serial_events = enrich(events, 1, 0, latency_seconds)
+    print(f'  one at a time                            {serial_seconds * 1000:8.1f} ms  {serial_calls} searches')
+
+    for max_workers, rate_limit in [(8, 0), (16, 0), (16, 50)]:
+        seconds, calls, tagged_events = enrich(events, max_workers, rate_limit, latency_seconds)
+        assert json.dumps(tagged_events) == json.dumps(serial_events) and calls == serial_calls
+
+        label = f'{max_workers} workers, ' + (f'{rate_limit:.0f}/s limit' if rate_limit else 'no limit')
+        print(f'  {label:<40} {seconds * 1000:8.1f} ms  speedup {serial_seconds / seconds:5.1f}x')
+
+        if rate_limit:
+            assert seconds >= (calls - 1) / rate_limit
+
+    for max_workers, batch_size, page_size in [(1, 20, 0), (8, 20, 0), (8, 20, 5)]:
+        seconds, calls, tagged_events = enrich(events, max_workers, 0, latency_seconds, batch_size, page_size)
+        assert json.dumps(tagged_events) == json.dumps(serial_events)
+
+        label = f'{max_workers} workers, batches of {batch_size}' + (f', pages of {page_size}' if page_size else '')
+        print(f'  {label:<40} {seconds * 1000:8.1f} ms  speedup {serial_seconds / seconds:5.1f}x  {calls} searches')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 50,
+         float(sys.argv[2]) if len(sys.argv) > 2 else 50)
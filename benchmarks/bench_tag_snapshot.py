@@ -0,0 +1,88 @@
+#
+# oci-opentelemetry benchmarks.
+#
+# Copyright (c) 2024, Oracle and/or its affiliates. All rights reserved.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl.
+
+"""
+Warm start of the tag-enrich cache for a payload whose OCIDs all live in a few compartments, each case on a
+freshly loaded function against the stub Search client with injected latency: a cold cache (batched look-ups of
+the payload's OCIDs), compartment warm-up (TAG_WARMUP_COMPARTMENTS) and loading the snapshot the warm-up wrote
+(TAG_SNAPSHOT_PATH), plain and gzip compressed.  The tagged payloads must be identical, and neither warm start
+may search while tagging.
+
+    python benchmarks/bench_tag_snapshot.py [compartments] [resources_per_compartment] [latency_ms]
+"""
+
+import copy
+import json
+import os
+import sys
+import tempfile
+import time
+
+os.environ['LOGGING_LEVEL'] = 'WARNING'
+
+from stub_search import StubSearchClient, compartment_resource_ocids, load_tag_enrich_function
+
+
+def enrich(events, compartment_size: int, latency_seconds: float, warmup_compartments: list = (),
+           snapshot_path: str = ''):
+    """
+    :return: tuple of (initialization seconds, initialization searches, tagging seconds, tagging searches,
+    tagged events)
+    """
+
+    os.environ['TAG_WARMUP_COMPARTMENTS'] = ','.join(warmup_compartments)
+    os.environ['TAG_SNAPSHOT_PATH'] = snapshot_path
+    os.environ['TAG_SEARCH_RATE_LIMIT'] = '0'
+    search_client = StubSearchClient(latency_seconds=latency_seconds, page_size=100,
+                                     compartment_size=compartment_size)
+    tag_enrich_func = load_tag_enrich_function(search_client)
+
+    start = time.perf_counter()
+    tag_enrich_func.initialize_tag_cache()
+    initialization_seconds = time.perf_counter() - start
+    initialization_searches = search_client.calls
+
+    events = copy.deepcopy(events)
+    start = time.perf_counter()
+    tag_enrich_func.add_tags_to_payload(events)
+    return (initialization_seconds, initialization_searches, time.perf_counter() - start,
+            search_client.calls - initialization_searches, events)
+
+
+def main(compartment_count: int, compartment_size: int, latency_ms: float):
+
+    compartments = [f'ocid1.compartment.oc1..bench{index:08d}' for index in range(compartment_count)]
+    events = [{'vnicId': ocid} for compartment_id in compartments
+              for ocid in compartment_resource_ocids(compartment_id, compartment_size)]
+    latency_seconds = latency_ms / 1000
+    print(f'{len(events)} events / {compartment_count} compartments / search latency {latency_ms:.0f} ms')
+    print(f'  {"":<30} {"init ms":>10} {"searches":>9} {"tagging ms":>11} {"searches":>9}')
+
+    def report(label, result):
+        print(f'  {label:<30} {result[0] * 1000:10.1f} {result[1]:9} {result[2] * 1000:11.1f} {result[3]:9}')
+
+    cold = enrich(events, compartment_size, latency_seconds)
+    report('cold', cold)
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name in ['tags.json', 'tags.json.gz']:
+            snapshot_path = os.path.join(directory, name)
+
+            warmed_up = enrich(events, compartment_size, latency_seconds, compartments, snapshot_path)
+            report(f'warm-up, writes {name}', warmed_up)
+
+            loaded = enrich(events, compartment_size, latency_seconds, compartments, snapshot_path)
+            report(f'load {name} ({os.path.getsize(snapshot_path) // 1024} KiB)', loaded)
+
+            for result in [warmed_up, loaded]:
+                assert json.dumps(result[4]) == json.dumps(cold[4]) and result[3] == 0
+            assert loaded[1] == 0
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 1000,
+         float(sys.argv[3]) if len(sys.argv) > 3 else 50)
@@ -0,0 +1,59 @@
+#
+# oci-opentelemetry benchmarks.
+#
+# Copyright (c) 2024, Oracle and/or its affiliates. All rights reserved.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl.
+
+"""
+Per-record timestamp parse cost of the log function: the previous dateutil parse (rounded to whole seconds)
+against the RFC 3339 fast path, with distinct timestamps (memo misses) and with a batch that repeats them.
+
+    python benchmarks/bench_timestamps.py [record_count]
+"""
+
+import sys
+
+from dateutil import parser
+
+from common import load_function, time_call
+
+
+def dateutil_unix_time_nano(timestamp_str: str):
+    """
+    The parse used before the fast path
+    """
+
+    timestamp_int = int(round(parser.parse(timestamp_str).timestamp()))
+    while timestamp_int < 1000000000000000000:
+        timestamp_int *= 10
+
+    return timestamp_int
+
+
+def main(record_count: int):
+
+    logs_func = load_function('oci-log-otel')
+
+    distinct = [f'2023-07-{1 + i // 86400 % 28:02d}T{i // 3600 % 24:02d}:{i // 60 % 60:02d}:{i % 60:02d}.{i % 1000:03d}Z'
+                for i in range(record_count)]
+    repeated = [distinct[i % 60] for i in range(record_count)]
+
+    def fast_path(timestamps):
+        logs_func.timestamp_cache.clear()
+        return [logs_func.get_unix_time_nano(timestamp) for timestamp in timestamps]
+
+    print(f'timestamps {record_count}')
+    for label, timestamps in [('distinct', distinct), ('repeated', repeated)]:
+        before_seconds, before = time_call(lambda: [dateutil_unix_time_nano(timestamp) for timestamp in timestamps])
+        after_seconds, after = time_call(lambda: fast_path(timestamps))
+
+        # same instant, but the fast path keeps the milliseconds
+        assert all(abs(b - a) < 1000000000 for a, b in zip(after, before))
+
+        print(f'  {label:<9} dateutil {before_seconds * 1e6 / record_count:8.2f} us/record / '
+              f'fast path {after_seconds * 1e6 / record_count:6.2f} us/record / '
+              f'speedup {before_seconds / after_seconds:6.1f}x')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
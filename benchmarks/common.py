@@ -0,0 +1,65 @@
+#
+# oci-opentelemetry benchmarks.
+#
+# Copyright (c) 2024, Oracle and/or its affiliates. All rights reserved.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl.
+
+import importlib.util
+import math
+import os
+import statistics
+import time
+
+from fdk.context import InvokeContext
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_function(function_dir: str, module_name: str = None):
+    """
+    Every function lives in its own directory as 'func.py', so they are loaded by path under distinct
+    module names.  Function configuration is read from the environment at import time, so set any
+    environment variables before calling this.
+    :param function_dir: e.g. 'oci-metrics-otel'
+    :param module_name: defaults to the directory name with dashes replaced
+    :return: the loaded func module
+    """
+
+    module_name = module_name or function_dir.replace('-', '_')
+    path = os.path.join(REPO_ROOT, function_dir, 'func.py')
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def time_call(fn, repeat: int = 5):
+    """
+    :return: tuple of (median seconds, last result) over 'repeat' runs of fn()
+    """
+
+    durations = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        durations.append(time.perf_counter() - start)
+
+    return statistics.median(durations), result
+
+
+def percentile(values: list, fraction: float):
+    """
+    :return: nearest-rank percentile of 'values', e.g. fraction 0.95 for p95
+    """
+
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))]
+
+
+def invoke_context(fn_name: str):
+    """
+    :return: an fdk InvokeContext like the one the Functions runtime passes to handler()
+    """
+
+    return InvokeContext(app_id='bench', app_name='bench', fn_id='bench', fn_name=fn_name, call_id='bench')
@@ -0,0 +1,227 @@
+#
+# oci-opentelemetry benchmarks.
+#
+# Copyright (c) 2024, Oracle and/or its affiliates. All rights reserved.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl.
+
+"""
+Synthetic OCI event generators shaped like the Service Connector payloads the functions receive.
+"""
+
+import random
+
+BASE_TIMESTAMP_MS = 1689108090000
+
+
+def ocid(resource_type: str, index: int):
+    return f'ocid1.{resource_type}.oc1.phx.aaaaaaaa{index:0>52}'
+
+
+def metric_events(event_count: int, datapoints_per_event: int = 1, series_count: int = 20, dimension_count: int = 1,
+                  seed: int = 7):
+    """
+    OCI Monitoring metric events.  Events cycle over 'series_count' distinct name / resourceId pairs.
+    'dimension_count' - 1 extra dimensions are added to resourceId, all fixed per series.
+    """
+
+    rnd = random.Random(seed)
+    events = []
+    for i in range(event_count):
+        series = i % series_count
+        dimensions = {'resourceId': ocid('vnic', series)}
+        for dimension in range(1, dimension_count):
+            dimensions[f'dimension{dimension}'] = f'series-{series}-value-{dimension}'
+
+        events.append({
+            'namespace': 'oci_vcn',
+            'resourceGroup': None,
+            'compartmentId': ocid('compartment', series % 3),
+            'name': f'VnicEgressDrops{series % 5}',
+            'dimensions': dimensions,
+            'metadata': {'displayName': 'Egress Packets Dropped by Full Connection Tracking Table',
+                         'unit': 'packets'},
+            'datapoints': [{'timestamp': BASE_TIMESTAMP_MS + (i * datapoints_per_event + j) * 1000,
+                            'value': rnd.random() * 100,
+                            'count': rnd.randint(1, 10)} for j in range(datapoints_per_event)]
+        })
+
+    return events
+
+
+def vcn_flow_log_events(event_count: int, log_count: int = 4, seed: int = 7):
+    """
+    OCI Logging VCN flow log events.  Events cycle over 'log_count' distinct log ids.
+    """
+
+    rnd = random.Random(seed)
+    events = []
+    for i in range(event_count):
+        log = i % log_count
+        events.append({
+            'datetime': BASE_TIMESTAMP_MS + i,
+            'logContent': {
+                'data': {
+                    'action': rnd.choice(['ACCEPT', 'REJECT']),
+                    'bytesOut': rnd.randint(40, 100000),
+                    'destinationAddress': f'10.0.{rnd.randint(0, 255)}.{rnd.randint(0, 255)}',
+                    'destinationPort': rnd.choice([22, 443, 8080]),
+                    'endTime': 1689108091 + i,
+                    'flowid': f'{rnd.getrandbits(32):08x}',
+                    'packets': rnd.randint(1, 50),
+                    'protocol': 6,
+                    'protocolName': 'TCP',
+                    'sourceAddress': f'10.0.0.{rnd.randint(0, 255)}',
+                    'sourcePort': rnd.randint(1024, 65535),
+                    'startTime': 1689108090 + i,
+                    'status': 'OK',
+                    'version': '2'
+                },
+                'id': f'{rnd.getrandbits(32):08x}',
+                'oracle': {
+                    'compartmentid': ocid('compartment', 0),
+                    'ingestedtime': '2023-07-11T20:42:24.573Z',
+                    'loggroupid': ocid('loggroup', 0),
+                    'logid': ocid('log', log),
+                    'tenantid': ocid('tenancy', 0),
+                    'vniccompartmentocid': ocid('compartment', 0),
+                    'vnicocid': ocid('vnic', log),
+                    'vnicsubnetocid': ocid('subnet', log)
+                },
+                'source': '-',
+                'specversion': '1.0',
+                'time': f'2023-07-11T20:41:{i % 60:02d}.{i % 1000:03d}Z',
+                'type': 'com.oraclecloud.vcn.flowlogs.DataEvent'
+            }
+        })
+
+    return events
+
+
+def audit_log_events(event_count: int, nesting_depth: int = 6, seed: int = 7):
+    """
+    OCI Audit events.  'nesting_depth' levels of additionalDetails are added under data so that keys found
+    late in the tree (or not at all) cost a deep walk.
+    """
+
+    rnd = random.Random(seed)
+    events = []
+    for i in range(event_count):
+
+        additional_details = {'depth': nesting_depth}
+        for depth in range(nesting_depth, 0, -1):
+            additional_details = {'level': depth, 'attributes': [{'name': f'attr{depth}', 'value': str(depth)}],
+                                  'details': additional_details}
+
+        events.append({
+            'datetime': BASE_TIMESTAMP_MS + i,
+            'logContent': {
+                'data': {
+                    'additionalDetails': additional_details,
+                    'availabilityDomain': 'AD3',
+                    'compartmentId': ocid('compartment', i % 3),
+                    'compartmentName': 'observability',
+                    'definedTags': None,
+                    'eventGroupingId': f'{rnd.getrandbits(64):016x}',
+                    'eventName': rnd.choice(['GetBucket', 'ListInstances', 'UpdateVcn']),
+                    'freeformTags': None,
+                    'identity': {
+                        'authType': 'natv',
+                        'callerId': None,
+                        'callerName': None,
+                        'consoleSessionId': None,
+                        'credentials': 'ST$eyJraWQiOiJhc3dfb2MxXzE',
+                        'ipAddress': f'10.0.0.{rnd.randint(0, 255)}',
+                        'principalId': ocid('user', i % 7),
+                        'principalName': 'service-account',
+                        'tenantId': ocid('tenancy', 0),
+                        'userAgent': 'Oracle-JavaSDK/3.0.0'
+                    },
+                    'request': {
+                        'action': 'GET',
+                        'headers': {'Accept': ['application/json'], 'opc-request-id': [f'{rnd.getrandbits(64):x}']},
+                        'id': f'{rnd.getrandbits(64):x}',
+                        'parameters': {},
+                        'path': '/20160918/vcns'
+                    },
+                    'resourceId': ocid('vcn', i % 11),
+                    'response': {
+                        'headers': {'Content-Type': ['application/json']},
+                        'message': None,
+                        'payload': {'id': ocid('vcn', i % 11), 'resourceName': f'vcn-{i % 11}'},
+                        'responseTime': '2023-07-11T20:41:30.382Z',
+                        'status': '200'
+                    },
+                    'stateChange': {'current': None, 'previous': None}
+                },
+                'dataschema': '2.0',
+                'id': f'{rnd.getrandbits(64):x}',
+                'oracle': {
+                    'compartmentid': ocid('compartment', i % 3),
+                    'ingestedtime': '2023-07-11T20:41:38.470Z',
+                    'loggroupid': '_Audit',
+                    'tenantid': ocid('tenancy', 0)
+                },
+                'source': f'vcn-{i % 11}',
+                'specversion': '1.0',
+                'time': f'2023-07-11T20:41:{i % 60:02d}.{i % 1000:03d}Z',
+                'type': 'com.oraclecloud.virtualNetwork.GetVcn'
+            }
+        })
+
+    return events
+
+
+def service_log_events(event_count: int, log_count: int = 4, nesting_depth: int = 2, seed: int = 7):
+    """
+    OCI Logging service log events (API Gateway access logs).  Events cycle over 'log_count' distinct log ids.
+    'nesting_depth' levels of request context are added under data.
+    """
+
+    rnd = random.Random(seed)
+    events = []
+    for i in range(event_count):
+        log = i % log_count
+
+        context = {'depth': nesting_depth}
+        for depth in range(nesting_depth, 0, -1):
+            context = {'level': depth, 'labels': [f'label{depth}'], 'context': context}
+
+        events.append({
+            'datetime': BASE_TIMESTAMP_MS + i,
+            'logContent': {
+                'data': {
+                    'apiDeploymentId': ocid('apideployment', log),
+                    'gatewayId': ocid('apigateway', log),
+                    'requestId': f'{rnd.getrandbits(64):016x}',
+                    'request': {
+                        'method': rnd.choice(['GET', 'POST', 'PUT']),
+                        'path': f'/v1/orders/{rnd.randint(1, 100000)}',
+                        'protocol': 'HTTP/1.1',
+                        'userAgent': 'curl/8.0.1',
+                        'clientIp': f'192.168.{rnd.randint(0, 255)}.{rnd.randint(0, 255)}'
+                    },
+                    'response': {
+                        'status': rnd.choice([200, 200, 200, 201, 404, 500]),
+                        'bytesSent': rnd.randint(100, 50000),
+                        'latencyMs': round(rnd.random() * 250, 3)
+                    },
+                    'context': context
+                },
+                'id': f'{rnd.getrandbits(32):08x}',
+                'oracle': {
+                    'compartmentid': ocid('compartment', log % 2),
+                    'ingestedtime': '2023-07-11T20:42:24.573Z',
+                    'loggroupid': ocid('loggroup', 1),
+                    'logid': ocid('log', 100 + log),
+                    'resourceid': ocid('apideployment', log),
+                    'tenantid': ocid('tenancy', 0)
+                },
+                'source': f'deployment-{log}',
+                'specversion': '1.0',
+                'subject': '',
+                'time': f'2023-07-11T20:41:{i % 60:02d}.{i % 1000:03d}Z',
+                'type': 'com.oraclecloud.apigateway.apideployment.access'
+            }
+        })
+
+    return events
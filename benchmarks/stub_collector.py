@@ -0,0 +1,145 @@
+#
+# oci-opentelemetry benchmarks.
+#
+# Copyright (c) 2024, Oracle and/or its affiliates. All rights reserved.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl.
+
+"""
+In-process stand-in for the OpenTelemetry Collector's OTLP receivers, for benchmarks and local runs.
+"""
+
+import threading
+import time
+from concurrent import futures
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import grpc
+except ImportError:
+    grpc = None
+
+from opentelemetry.proto.collector.logs.v1.logs_service_pb2 import ExportLogsServiceRequest, ExportLogsServiceResponse
+from opentelemetry.proto.collector.metrics.v1.metrics_service_pb2 import ExportMetricsServiceRequest, \
+    ExportMetricsServiceResponse
+
+
+class StubHttpCollector:
+    """
+    OTLP/HTTP receiver on a local port accepting any POST path.  Bodies are counted as received (still
+    compressed), not decoded or kept.
+    :param fail_first: number of requests answered with fail_status before the collector starts accepting
+    :param latency_seconds: delay added before every response
+    """
+
+    def __init__(self, fail_first: int = 0, fail_status: int = 503, latency_seconds: float = 0.0):
+        self.fail_first = fail_first
+        self.fail_status = fail_status
+        self.latency_seconds = latency_seconds
+        self.calls = 0
+        self.requests = 0
+        self.request_bytes = 0
+        self.content_types = {}
+        self.lock = threading.Lock()
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.request_handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def url(self, path: str = '/v1/logs'):
+        return f'http://127.0.0.1:{self.server.server_port}{path}'
+
+    def request_handler(self):
+        collector = self
+
+        class OtlpHttpRequestHandler(BaseHTTPRequestHandler):
+
+            # HTTP/1.1 keeps the function's pooled connections open, as a real collector would
+
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if collector.latency_seconds:
+                    time.sleep(collector.latency_seconds)
+
+                with collector.lock:
+                    collector.calls += 1
+                    status = collector.fail_status if collector.calls <= collector.fail_first else 200
+                    if status == 200:
+                        collector.requests += 1
+                        collector.request_bytes += len(body)
+                        content_type = (self.headers.get('Content-Type', ''), self.headers.get('Content-Encoding'))
+                        collector.content_types[content_type] = collector.content_types.get(content_type, 0) + 1
+
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        return OtlpHttpRequestHandler
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class StubGrpcCollector:
+    """
+    OTLP/gRPC LogsService and MetricsService on a local port.  Requests are counted, not kept.
+    :param fail_first: number of calls answered with fail_code before the collector starts accepting
+    :param max_message_bytes: server side receive limit
+    """
+
+    def __init__(self, fail_first: int = 0, fail_code=None, max_message_bytes: int = 4194304):
+        self.fail_first = fail_first
+        self.fail_code = fail_code or grpc.StatusCode.UNAVAILABLE
+        self.calls = 0
+        self.requests = 0
+        self.request_bytes = 0
+        self.resource_count = 0
+        self.lock = threading.Lock()
+
+        self.server = grpc.server(futures.ThreadPoolExecutor(max_workers=8),
+                                  options=[('grpc.max_receive_message_length', max_message_bytes)])
+        self.server.add_generic_rpc_handlers([
+            self.service_handler('opentelemetry.proto.collector.logs.v1.LogsService',
+                                 ExportLogsServiceRequest, ExportLogsServiceResponse, 'resource_logs'),
+            self.service_handler('opentelemetry.proto.collector.metrics.v1.MetricsService',
+                                 ExportMetricsServiceRequest, ExportMetricsServiceResponse, 'resource_metrics'),
+        ])
+        self.port = self.server.add_insecure_port('127.0.0.1:0')
+
+    @property
+    def endpoint(self):
+        return f'127.0.0.1:{self.port}'
+
+    def service_handler(self, service_name, request_type, response_type, resource_field):
+
+        def export(request, context):
+            with self.lock:
+                self.calls += 1
+                if self.calls <= self.fail_first:
+                    context.abort(self.fail_code, f'stub failure {self.calls} of {self.fail_first}')
+
+                self.requests += 1
+                self.request_bytes += request.ByteSize()
+                self.resource_count += len(getattr(request, resource_field))
+
+            return response_type()
+
+        handler = grpc.unary_unary_rpc_method_handler(export, request_deserializer=request_type.FromString,
+                                                      response_serializer=response_type.SerializeToString)
+        return grpc.method_handlers_generic_handler(service_name, {'Export': handler})
+
+    def __enter__(self):
+        self.server.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.stop(grace=None)
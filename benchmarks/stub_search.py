@@ -0,0 +1,91 @@
+#
+# oci-opentelemetry benchmarks.
+#
+# Copyright (c) 2024, Oracle and/or its affiliates. All rights reserved.
+# Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl.
+
+"""
+In-process stand-in for the OCI Resource Search client used by the tag-enrich function.
+"""
+
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+from common import load_function
+
+IDENTIFIER_PATTERN = re.compile(r"identifier\s*=\s*'([^']+)'")
+COMPARTMENT_PATTERN = re.compile(r"compartmentId\s*=\s*'([^']+)'")
+
+
+class StubSearchClient:
+    """
+    Answers search_resources() for every identifier in the structured query with a resource summary
+    carrying freeform, defined and system tags derived from the OCID.  A compartmentId query finds
+    'compartment_size' resources per compartment, see compartment_resource_ocids.  Results come back in reverse query
+    order, as the Search API does not keep it, and in pages of 'page_size' items when set.
+    :param latency_seconds: delay added to every call, standing in for the Search API round trip
+    :param page_size: items per page, 0 for a single page
+    :param compartment_size: resources found per compartment
+    """
+
+    def __init__(self, latency_seconds: float = 0.0, page_size: int = 0, compartment_size: int = 100):
+        self.latency_seconds = latency_seconds
+        self.page_size = page_size
+        self.compartment_size = compartment_size
+        self.calls = 0
+        self.identifiers = 0
+        self.lock = threading.Lock()
+
+    def search_resources(self, search_details, **kwargs):
+        identifiers = IDENTIFIER_PATTERN.findall(search_details.query)
+        for compartment_id in COMPARTMENT_PATTERN.findall(search_details.query):
+            identifiers += compartment_resource_ocids(compartment_id, self.compartment_size)
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+
+        with self.lock:
+            self.calls += 1
+            self.identifiers += len(identifiers)
+
+        items = [resource_summary(identifier) for identifier in reversed(identifiers)]
+        next_page = None
+        if self.page_size:
+            start = int(kwargs.get('page') or 0)
+            if start + self.page_size < len(items):
+                next_page = str(start + self.page_size)
+            items = items[start:start + self.page_size]
+
+        return SimpleNamespace(data=SimpleNamespace(items=items), has_next_page=next_page is not None,
+                               next_page=next_page)
+
+
+def compartment_resource_ocids(compartment_id: str, count: int):
+    """
+    :return: the OCIDs of the resources the stub finds in a compartment
+    """
+
+    return [f'ocid1.vnic.oc1.iad.{compartment_id[-8:]}{index:06d}' for index in range(count)]
+
+
+def resource_summary(identifier: str):
+
+    suffix = identifier[-4:]
+    return SimpleNamespace(
+        identifier=identifier,
+        resource_type=identifier.split('.')[1],
+        freeform_tags={'environment': 'bench', 'owner': f'team-{suffix}'},
+        defined_tags={'Operations': {'CostCenter': suffix, 'Project': 'observability'}},
+        system_tags={'orcl-cloud': {'free-tier-retained': 'true'}})
+
+
+def load_tag_enrich_function(search_client):
+    """
+    Loads oci-tag-enrich outside of OCI Functions with every thread searching through 'search_client' instead
+    of a resource principals client.  Requires the 'oci' package.
+    """
+
+    tag_enrich_func = load_function('oci-tag-enrich')
+    tag_enrich_func.get_search_client = lambda: search_client
+    return tag_enrich_func
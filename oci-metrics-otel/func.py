@@ -4,28 +4,193 @@
 # Copyright (c) 2022, Oracle and/or its affiliates. All rights reserved.
 # Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl.
 
+import bisect
+import codecs
+import contextlib
+import cProfile
+import functools
+import gzip
 import io
 import json
 import logging
 import os
+import pstats
+import random
+import re
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 import requests
 from fdk import response
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+try:
+    import grpc
+except ImportError:
+    grpc = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 from google.protobuf.internal.well_known_types import Timestamp
 from google.protobuf.json_format import MessageToDict
+from opentelemetry.proto.collector.metrics.v1.metrics_service_pb2 import DESCRIPTOR as METRICS_SERVICE_DESCRIPTOR
+from opentelemetry.proto.collector.metrics.v1.metrics_service_pb2 import ExportMetricsServiceResponse
 from opentelemetry.proto.common.v1.common_pb2 import InstrumentationScope, KeyValueList, KeyValue, AnyValue, ArrayValue
 from opentelemetry.proto.logs.v1.logs_pb2 import LogRecord, LogsData, ResourceLogs, ScopeLogs
-from opentelemetry.proto.metrics.v1.metrics_pb2 import MetricsData, ScopeMetrics, ResourceMetrics, Metric, Sum, Gauge, \
-    Histogram, Summary, HistogramDataPoint, NumberDataPoint
+from opentelemetry.proto.metrics.v1.metrics_pb2 import MetricsData, ScopeMetrics, ResourceMetrics, Metric, Sum, \
+    Histogram, Summary, HistogramDataPoint, NumberDataPoint, SummaryDataPoint, AGGREGATION_TEMPORALITY_DELTA
 from opentelemetry.proto.resource.v1.resource_pb2 import Resource
 
 # Set these environment variables via Function configuration
 
 API_ENDPOINT = os.getenv('OTEL_COLLECTOR_METRICS_API_ENDPOINT', 'not-configured')
+GRPC_ENDPOINT = os.getenv('OTEL_COLLECTOR_GRPC_ENDPOINT', 'not-configured')
 OTEL_METRIC_RESOURCE_ATTR_MAP = os.getenv('OTEL_METRIC_RESOURCE_ATTR_MAP', 'dimensions compartmentId').split(" ")
 OTEL_METRIC_SCOPE_ATTR_MAP = os.getenv('OTEL_METRIC_SCOPE_ATTR_MAP', 'namespace').split(" ")
 OTEL_DATAPOINT_ATTR_MAP = os.getenv('OTEL_DATAPOINT_ATTR_MAP', 'count').split(" ")
 
+# Map entries may be bare keys (found anywhere in the event, first match wins) or dotted key paths such
+# as 'data.vnicId' (the first step is found like a bare key, the rest are indexed).  When learning is enabled,
+# the position where a bare key was found is remembered per event shape (the keys of the event's top two
+# levels) so later events of the same shape are resolved by direct indexing.  A learned position is only used
+# where no earlier match can exist, so the results are the same as the first-match search.
+
+LEARN_ATTRIBUTE_PATHS = eval(os.getenv('LEARN_ATTRIBUTE_PATHS', "False"))
+
+# Built attributes are memoized per (key, value) since compartment, resource and namespace values repeat across
+# events.  List and dictionary values are cached when they hold at most OTEL_ATTRIBUTE_CACHE_MAX_ITEMS values
+# in total.  Set OTEL_ATTRIBUTE_CACHE_SIZE to 0 to disable the cache.
+
+OTEL_ATTRIBUTE_CACHE_SIZE = int(os.getenv('OTEL_ATTRIBUTE_CACHE_SIZE', '10000'))
+OTEL_ATTRIBUTE_CACHE_MAX_ITEMS = int(os.getenv('OTEL_ATTRIBUTE_CACHE_MAX_ITEMS', '32'))
+
+# Coalesce all datapoints of an OCI metric into one OTEL Metric (a single Gauge holding every data point)
+# rather than emitting a separate Metric + Gauge per datapoint.  Off by default, which keeps the original payload shape.
+
+COALESCE_METRIC_DATAPOINTS = eval(os.getenv('COALESCE_METRIC_DATAPOINTS', "False"))
+
+# Merge events that resolve to the same resource and scope attributes under a single ResourceMetrics / ScopeMetrics.
+# Off by default, which keeps one ResourceMetrics per OCI event.
+
+GROUP_RESOURCE_METRICS = eval(os.getenv('GROUP_RESOURCE_METRICS', "False"))
+
+# Pre-aggregation: 'summary' or 'histogram' folds the data points of each series (resource, scope, name, unit and
+# description) into one data point per OTEL_METRIC_AGGREGATION_WINDOW_SECONDS window.  'none' exports every OCI
+# data point.  Data point attributes are not carried over to aggregated points.
+# Histogram bucket bounds come from OTEL_METRIC_HISTOGRAM_BUCKETS unless the metric name has its own in
+# OTEL_METRIC_HISTOGRAM_BUCKETS_MAP, e.g. 'CpuUtilization=10,50,90 BytesReceived=1000,1000000'.
+# Summaries always report quantiles 0 and 1 (the window min and max) in addition to OTEL_METRIC_SUMMARY_QUANTILES.
+
+OTEL_METRIC_AGGREGATION = os.getenv('OTEL_METRIC_AGGREGATION', 'none')
+OTEL_METRIC_AGGREGATION_WINDOW_SECONDS = int(os.getenv('OTEL_METRIC_AGGREGATION_WINDOW_SECONDS', '60'))
+
+if OTEL_METRIC_AGGREGATION in ['summary', 'histogram'] and OTEL_METRIC_AGGREGATION_WINDOW_SECONDS <= 0:
+    raise ValueError(f'configuration / OTEL_METRIC_AGGREGATION_WINDOW_SECONDS must be at least 1 / '
+                     f'{OTEL_METRIC_AGGREGATION_WINDOW_SECONDS}')
+
+OTEL_METRIC_HISTOGRAM_BUCKETS = sorted(float(bound) for bound in
+                                       os.getenv('OTEL_METRIC_HISTOGRAM_BUCKETS', '0 5 10 25 50 75 100 250 500 1000').split())
+OTEL_METRIC_HISTOGRAM_BUCKETS_MAP = {name: sorted(float(bound) for bound in bounds.split(','))
+                                     for name, bounds in (entry.split('=', 1) for entry in
+                                                          os.getenv('OTEL_METRIC_HISTOGRAM_BUCKETS_MAP', '').split())}
+OTEL_METRIC_SUMMARY_QUANTILES = sorted({0.0, 1.0} | {float(quantile) for quantile in
+                                                     os.getenv('OTEL_METRIC_SUMMARY_QUANTILES', '0.5 0.9 0.99').split()})
+
+# Events with at least OTEL_VECTORIZE_MIN_DATAPOINTS datapoints have their timestamps normalized to nanoseconds as
+# one array when numpy is installed.  Smaller events (or without numpy) use a per-value lookup table.
+
+OTEL_VECTORIZE_MIN_DATAPOINTS = int(os.getenv('OTEL_VECTORIZE_MIN_DATAPOINTS', '64'))
+
+# OTLP/HTTP payload encoding: 'protobuf' posts binary application/x-protobuf, otherwise JSON is posted
+
+OTEL_EXPORT_ENCODING = os.getenv('OTEL_EXPORT_ENCODING', 'json')
+
+# Export protocol: 'http' posts to API_ENDPOINT, 'grpc' calls the OTLP MetricsService at GRPC_ENDPOINT (host:port,
+# TLS when prefixed with https://) and always sends protobuf.  gRPC requires adding the grpcio package to
+# requirements.txt; without it the handler raises a configuration error.  The channel is created on first
+# use and kept for the life of the function container.
+
+OTEL_EXPORT_PROTOCOL = os.getenv('OTEL_EXPORT_PROTOCOL', 'http')
+OTEL_EXPORT_GRPC_DEADLINE_SECONDS = float(os.getenv('OTEL_EXPORT_GRPC_DEADLINE_SECONDS', '30'))
+OTEL_EXPORT_GRPC_MAX_MESSAGE_BYTES = int(os.getenv('OTEL_EXPORT_GRPC_MAX_MESSAGE_BYTES', '4194304'))
+
+# Collector connection pool size and timeouts (seconds).  The HTTP session is created on first use and kept
+# for the life of the function container so that hot invocations reuse warm keep-alive connections.
+
+OTEL_EXPORT_POOL_SIZE = int(os.getenv('OTEL_EXPORT_POOL_SIZE', '10'))
+OTEL_EXPORT_CONNECT_TIMEOUT = float(os.getenv('OTEL_EXPORT_CONNECT_TIMEOUT', '5'))
+OTEL_EXPORT_READ_TIMEOUT = float(os.getenv('OTEL_EXPORT_READ_TIMEOUT', '30'))
+
+# Large batches are split into chunks bounded by request body bytes, in the configured encoding, and
+# data points, then sent concurrently by up to OTEL_EXPORT_MAX_WORKERS threads.
+
+OTEL_EXPORT_MAX_CHUNK_BYTES = int(os.getenv('OTEL_EXPORT_MAX_CHUNK_BYTES', '4000000'))
+OTEL_EXPORT_MAX_CHUNK_RECORDS = int(os.getenv('OTEL_EXPORT_MAX_CHUNK_RECORDS', '5000'))
+OTEL_EXPORT_MAX_WORKERS = int(os.getenv('OTEL_EXPORT_MAX_WORKERS', '4'))
+
+# Request compression: 'gzip', 'zstd' (requires the zstandard package, otherwise gzip is used) or 'none'.
+# Request bodies smaller than OTEL_EXPORT_COMPRESSION_MIN_BYTES are sent uncompressed.
+
+OTEL_EXPORT_COMPRESSION = os.getenv('OTEL_EXPORT_COMPRESSION', 'none')
+OTEL_EXPORT_COMPRESSION_LEVEL = int(os.getenv('OTEL_EXPORT_COMPRESSION_LEVEL', '6'))
+OTEL_EXPORT_COMPRESSION_MIN_BYTES = int(os.getenv('OTEL_EXPORT_COMPRESSION_MIN_BYTES', '1024'))
+
+# Failed exports are retried with exponential backoff and jitter (honoring Retry-After on 429 / 503).
+# Chunks that still fail are spooled to OTEL_EXPORT_SPOOL_DIR and replayed first by the next warm invocation.
+# The spool is bounded by OTEL_EXPORT_SPOOL_MAX_BYTES (oldest dropped first).  Set it to 0 to disable spooling.
+
+OTEL_EXPORT_MAX_RETRIES = int(os.getenv('OTEL_EXPORT_MAX_RETRIES', '3'))
+OTEL_EXPORT_BACKOFF_SECONDS = float(os.getenv('OTEL_EXPORT_BACKOFF_SECONDS', '0.5'))
+OTEL_EXPORT_BACKOFF_MAX_SECONDS = float(os.getenv('OTEL_EXPORT_BACKOFF_MAX_SECONDS', '10'))
+OTEL_EXPORT_SPOOL_DIR = os.getenv('OTEL_EXPORT_SPOOL_DIR', '/tmp/otel-export-spool')
+OTEL_EXPORT_SPOOL_MAX_BYTES = int(os.getenv('OTEL_EXPORT_SPOOL_MAX_BYTES', '20000000'))
+
+# Replay is bounded per invocation so that a slow collector cannot use the invocation up before the current
+# payload is handled: at most OTEL_EXPORT_SPOOL_REPLAY_MAX_FILES files, none started after
+# OTEL_EXPORT_SPOOL_REPLAY_MAX_SECONDS, and request timeouts cut to the time left.  The rest wait for later invocations.
+
+OTEL_EXPORT_SPOOL_REPLAY_MAX_FILES = int(os.getenv('OTEL_EXPORT_SPOOL_REPLAY_MAX_FILES', '10'))
+OTEL_EXPORT_SPOOL_REPLAY_MAX_SECONDS = float(os.getenv('OTEL_EXPORT_SPOOL_REPLAY_MAX_SECONDS', '10'))
+
+# Streaming ingestion decodes the top-level event array incrementally and assembles and exports every
+# OTEL_STREAM_BATCH_EVENTS events, so peak memory is bounded by the batch instead of the payload.  It uses the
+# ijson package when added to requirements.txt (optional) and the standard library decoder otherwise.
+
+OTEL_STREAM_INGESTION = eval(os.getenv('OTEL_STREAM_INGESTION', "False"))
+OTEL_STREAM_BATCH_EVENTS = int(os.getenv('OTEL_STREAM_BATCH_EVENTS', '500'))
+
+# Self telemetry: every invocation's stage timings (parse, assemble, chunk, serialize, compress, export) and counters
+# (events, records, attributes, bytes in / out, missing keys, retries, failures) are sent as OTLP metrics to
+# OTEL_SELF_TELEMETRY_ENDPOINT over HTTP once the export is done.  The endpoint defaults to the export endpoint.
+
+OTEL_SELF_TELEMETRY = eval(os.getenv('OTEL_SELF_TELEMETRY', "False"))
+OTEL_SELF_TELEMETRY_ENDPOINT = os.getenv('OTEL_SELF_TELEMETRY_ENDPOINT', API_ENDPOINT)
+
+# Sampled profiling: a PROFILE_SAMPLE_RATE fraction of invocations (0 disables, 1 profiles every one) runs under
+# cProfile and tracemalloc.  The PROFILE_TOP_N hottest functions and allocation sites are reported with the payload
+# size and the first event's namespace: logged, or written to PROFILE_DIR when PROFILE_OUTPUT is 'file'.
+
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_TOP_N = int(os.getenv('PROFILE_TOP_N', '15'))
+PROFILE_OUTPUT = os.getenv('PROFILE_OUTPUT', 'log')
+PROFILE_DIR = os.getenv('PROFILE_DIR', '/tmp/function-profiles')
+
 # What happens if a mapped key is not found in the OCI payload?
 
 RAISE_MISSING_MAP_KEY = eval(os.getenv('RAISE_MISSING_MAP_KEY', "True"))
@@ -41,7 +206,113 @@ LOGGING_LEVEL = os.getenv('LOGGING_LEVEL', 'INFO')
 loggers = [logging.getLogger()] + [logging.getLogger(name) for name in logging.root.manager.loggerDict]
 [logger.setLevel(logging.getLevelName(LOGGING_LEVEL)) for logger in loggers]
 
+# Module-level session shared by all invocations handled by this function container
+
+http_session = None
+http_session_lock = threading.Lock()
+grpc_channel = None
+grpc_export_method = None
+grpc_channel_lock = threading.Lock()
+
+# Compiled attribute maps and learned bare key positions: {(event shape, key): key path}
+
+compiled_attribute_maps = {}
+event_target_keys = {}
+learned_key_paths = {}
+LEARNED_KEY_PATHS_MAX_SIZE = 10000
+
+# Memoized attributes, least recently used first: {(key, frozen value): KeyValue}, see memoize_otel_attribute
+
+attribute_cache = OrderedDict()
+attribute_cache_stats = {'hits': 0, 'misses': 0}
+spool_lock = threading.Lock()
+
+# Self telemetry of the current invocation: {'start': perf_counter, 'start_time_unix_nano': ..., 'counters':
+# {name: value}, 'stages': {stage: [calls, seconds]}}.  Export threads update it under self_telemetry_lock.
+
+self_telemetry = {'start': 0.0, 'start_time_unix_nano': 0, 'counters': {}, 'stages': {}}
+self_telemetry_lock = threading.Lock()
+SELF_TELEMETRY_COUNTERS = ['events', 'records', 'attributes', 'bytes.in', 'bytes.out', 'missing_keys',
+                           'export.retries', 'export.failures']
+SELF_TELEMETRY_METRIC_PREFIX = 'oci.function.'
+SELF_TELEMETRY_SCOPE_NAME = 'oci-opentelemetry-metrics'
+SELF_TELEMETRY_SCOPE_VERSION = '1.0'
+NO_SELF_TELEMETRY_STAGE = contextlib.nullcontext()
+
+# Profiled invocations are keyed by the first event namespace found in the head of the payload, see peek_event_type
+
+EVENT_TYPE_PATTERN = re.compile(rb'"namespace"\s*:\s*"([^"]*)"')
+PROFILE_PEEK_BYTES = 65536
+PROFILE_MAX_FILES = 20
+
+# OTLP/HTTP status codes worth retrying
+
+RETRYABLE_STATUS_CODES = [429, 502, 503, 504]
+
+# OTLP/gRPC status codes worth retrying, see
+# https://opentelemetry.io/docs/specs/otlp/#failures
+
+RETRYABLE_GRPC_STATUS_CODES = ['CANCELLED', 'DEADLINE_EXCEEDED', 'RESOURCE_EXHAUSTED', 'ABORTED', 'OUT_OF_RANGE',
+                               'UNAVAILABLE', 'DATA_LOSS']
+
+# content type recorded for gRPC exports (in the spool, for instance)
+
+GRPC_CONTENT_TYPE = 'application/grpc'
+
+JSON_WHITESPACE = re.compile(r'[ \t\n\r]*')
+STREAM_DECODE_READ_BYTES = 65536
+
+# Nanosecond normalization table, see adjust_unix_time_to_nano: a timestamp with i + 1 digits (i bounds at or
+# below it) is scaled by NANO_SCALES[i]
+
+NANO_SCALE_BOUNDS = [10 ** digits for digits in range(1, 19)]
+NANO_SCALES = [10 ** (18 - index) for index in range(19)]
+
+
+def profile_sampled_invocations(handler_function):
+    """
+    Runs a PROFILE_SAMPLE_RATE fraction of the decorated handler's invocations under cProfile and tracemalloc
+    and reports them with report_invocation_profile.  Other invocations only pay for the sampling check.
+    """
+
+    @functools.wraps(handler_function)
+    def sampled_handler(ctx, data: io.BytesIO = None):
+
+        if PROFILE_SAMPLE_RATE <= 0 or random.random() >= PROFILE_SAMPLE_RATE:
+            return handler_function(ctx, data)
+
+        payload = data.getvalue() if data is not None else b''
+        profile = {'fn': ctx.FnName(), 'payload_bytes': len(payload), 'event_type': peek_event_type(payload)}
+
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
 
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        profiler.enable()
+
+        try:
+            return handler_function(ctx, data)
+
+        finally:
+            profiler.disable()
+            profile['seconds'] = time.perf_counter() - start
+            profile['peak_traced_bytes'] = tracemalloc.get_traced_memory()[1]
+            snapshot = tracemalloc.take_snapshot()
+            if started_tracing:
+                tracemalloc.stop()
+
+            try:
+                report_invocation_profile(profile, profiler, snapshot)
+            except Exception as ex:
+                logging.warning(f'profile / report failed / {ex}')
+
+    return sampled_handler
+
+
+@profile_sampled_invocations
 def handler(ctx, data: io.BytesIO = None):
     """
     OCI Function Entry Point
@@ -56,31 +327,161 @@ def handler(ctx, data: io.BytesIO = None):
     logging.debug(f'RAISE_MISSING_MAP_KEY / {RAISE_MISSING_MAP_KEY}')
     logging.debug(f'LOG_MISSING_MAP_KEY / {LOG_MISSING_MAP_KEY}')
     logging.debug(f'LOG_RECORD_CONTENT / {LOG_RECORD_CONTENT}')
+    logging.debug(f'OTEL_EXPORT_ENCODING / {OTEL_EXPORT_ENCODING}')
+    logging.debug(f'OTEL_EXPORT_PROTOCOL / {OTEL_EXPORT_PROTOCOL} / grpcio installed {grpc is not None}')
+    logging.debug(f'OTEL_EXPORT_GRPC_DEADLINE_SECONDS / {OTEL_EXPORT_GRPC_DEADLINE_SECONDS}')
+    logging.debug(f'OTEL_EXPORT_GRPC_MAX_MESSAGE_BYTES / {OTEL_EXPORT_GRPC_MAX_MESSAGE_BYTES}')
+    logging.debug(f'OTEL_EXPORT_POOL_SIZE / {OTEL_EXPORT_POOL_SIZE}')
+    logging.debug(f'OTEL_EXPORT_CONNECT_TIMEOUT / {OTEL_EXPORT_CONNECT_TIMEOUT}')
+    logging.debug(f'OTEL_EXPORT_READ_TIMEOUT / {OTEL_EXPORT_READ_TIMEOUT}')
+    logging.debug(f'OTEL_EXPORT_MAX_CHUNK_BYTES / {OTEL_EXPORT_MAX_CHUNK_BYTES}')
+    logging.debug(f'OTEL_EXPORT_MAX_CHUNK_RECORDS / {OTEL_EXPORT_MAX_CHUNK_RECORDS}')
+    logging.debug(f'OTEL_EXPORT_MAX_WORKERS / {OTEL_EXPORT_MAX_WORKERS}')
+    logging.debug(f'OTEL_EXPORT_COMPRESSION / {OTEL_EXPORT_COMPRESSION} / zstandard installed {zstandard is not None}')
+    logging.debug(f'OTEL_EXPORT_COMPRESSION_LEVEL / {OTEL_EXPORT_COMPRESSION_LEVEL}')
+    logging.debug(f'OTEL_EXPORT_COMPRESSION_MIN_BYTES / {OTEL_EXPORT_COMPRESSION_MIN_BYTES}')
+    logging.debug(f'OTEL_EXPORT_MAX_RETRIES / {OTEL_EXPORT_MAX_RETRIES}')
+    logging.debug(f'OTEL_EXPORT_BACKOFF_SECONDS / {OTEL_EXPORT_BACKOFF_SECONDS}')
+    logging.debug(f'OTEL_EXPORT_BACKOFF_MAX_SECONDS / {OTEL_EXPORT_BACKOFF_MAX_SECONDS}')
+    logging.debug(f'OTEL_EXPORT_SPOOL_DIR / {OTEL_EXPORT_SPOOL_DIR}')
+    logging.debug(f'OTEL_EXPORT_SPOOL_MAX_BYTES / {OTEL_EXPORT_SPOOL_MAX_BYTES}')
+    logging.debug(f'OTEL_EXPORT_SPOOL_REPLAY_MAX_FILES / {OTEL_EXPORT_SPOOL_REPLAY_MAX_FILES}')
+    logging.debug(f'OTEL_EXPORT_SPOOL_REPLAY_MAX_SECONDS / {OTEL_EXPORT_SPOOL_REPLAY_MAX_SECONDS}')
+    logging.debug(f'OTEL_STREAM_INGESTION / {OTEL_STREAM_INGESTION} / ijson installed {ijson is not None}')
+    logging.debug(f'OTEL_STREAM_BATCH_EVENTS / {OTEL_STREAM_BATCH_EVENTS}')
     logging.debug(f'OTEL_METRIC_RESOURCE_ATTR_MAP / {OTEL_METRIC_RESOURCE_ATTR_MAP}')
     logging.debug(f'OTEL_METRIC_SCOPE_ATTR_MAP / {OTEL_METRIC_SCOPE_ATTR_MAP}')
     logging.debug(f'OTEL_DATAPOINT_ATTR_MAP / {OTEL_DATAPOINT_ATTR_MAP}')
+    logging.debug(f'LEARN_ATTRIBUTE_PATHS / {LEARN_ATTRIBUTE_PATHS}')
+    logging.debug(f'OTEL_ATTRIBUTE_CACHE_SIZE / {OTEL_ATTRIBUTE_CACHE_SIZE}')
+    logging.debug(f'OTEL_ATTRIBUTE_CACHE_MAX_ITEMS / {OTEL_ATTRIBUTE_CACHE_MAX_ITEMS}')
+    logging.debug(f'COALESCE_METRIC_DATAPOINTS / {COALESCE_METRIC_DATAPOINTS}')
+    logging.debug(f'GROUP_RESOURCE_METRICS / {GROUP_RESOURCE_METRICS}')
+    logging.debug(f'OTEL_METRIC_AGGREGATION / {OTEL_METRIC_AGGREGATION}')
+    logging.debug(f'OTEL_METRIC_AGGREGATION_WINDOW_SECONDS / {OTEL_METRIC_AGGREGATION_WINDOW_SECONDS}')
+    logging.debug(f'OTEL_METRIC_HISTOGRAM_BUCKETS / {OTEL_METRIC_HISTOGRAM_BUCKETS}')
+    logging.debug(f'OTEL_METRIC_HISTOGRAM_BUCKETS_MAP / {OTEL_METRIC_HISTOGRAM_BUCKETS_MAP}')
+    logging.debug(f'OTEL_METRIC_SUMMARY_QUANTILES / {OTEL_METRIC_SUMMARY_QUANTILES}')
+    logging.debug(f'OTEL_VECTORIZE_MIN_DATAPOINTS / {OTEL_VECTORIZE_MIN_DATAPOINTS} / numpy installed {numpy is not None}')
+    logging.debug(f'OTEL_SELF_TELEMETRY / {OTEL_SELF_TELEMETRY}')
+    logging.debug(f'OTEL_SELF_TELEMETRY_ENDPOINT / {OTEL_SELF_TELEMETRY_ENDPOINT}')
+    logging.debug(f'PROFILE_SAMPLE_RATE / {PROFILE_SAMPLE_RATE}')
+    logging.debug(f'PROFILE_TOP_N / {PROFILE_TOP_N}')
+    logging.debug(f'PROFILE_OUTPUT / {PROFILE_OUTPUT}')
+    logging.debug(f'PROFILE_DIR / {PROFILE_DIR}')
+
+    start_self_telemetry()
 
     try:
-        event_list = json.loads(data.getvalue())
+        if OTEL_EXPORT_PROTOCOL == 'grpc' and grpc is None:
+            raise ValueError('configuration / OTEL_EXPORT_PROTOCOL is grpc but grpcio is not installed')
+
+        replay_otel_spool()
+
+        count_self_telemetry('bytes.in', len(data.getvalue()))
+
+        if OTEL_STREAM_INGESTION is True:
+            event_count = export_otel_event_stream(iterate_events(data))
+            count_self_telemetry('events', event_count)
+            logging.info(f'fn {ctx.FnName()} / metric event count {event_count}')
+            return
+
+        with time_self_telemetry_stage('parse'):
+            event_list = json.loads(data.getvalue())
+
+        count_self_telemetry('events', len(event_list))
         logging.info(f'fn {ctx.FnName()} / metric event count {len(event_list)}')
 
-        logs_data = assemble_otel_metrics_data(event_list=event_list)
-        logs_data_json = serialize_otel_message_to_json(logs_data)
-        send_to_otel_collector(logs_data_json=logs_data_json)
+        with time_self_telemetry_stage('assemble'):
+            metrics_data = assemble_otel_metrics_data(event_list=event_list)
+
+        export_otel_message(metrics_data)
 
     except (Exception, ValueError) as ex:
         logging.error('error handling logging payload: {}'.format(str(ex)))
 
+    finally:
+        logging.info(f'attribute cache / entries {len(attribute_cache)} / '
+                     f'hits {attribute_cache_stats["hits"]} / misses {attribute_cache_stats["misses"]}')
+        export_self_telemetry(ctx)
+
+
+def peek_event_type(payload: bytes):
+    """
+    :return: the first EVENT_TYPE_PATTERN match in the head of the raw payload, without decoding it
+    """
+
+    match = EVENT_TYPE_PATTERN.search(payload, 0, PROFILE_PEEK_BYTES)
+    return match.group(1).decode('utf-8', 'replace') if match else 'unknown'
+
+
+def report_invocation_profile(profile: dict, profiler, snapshot):
+    """
+    Summarizes a profiled invocation: the PROFILE_TOP_N functions with the most self time (handler thread
+    only), and the PROFILE_TOP_N source lines holding the most memory allocated during the invocation and still
+    live at its end.  The summary is logged, or written to PROFILE_DIR together with the raw cProfile stats
+    when PROFILE_OUTPUT is 'file'.
+    """
+
+    lines = [f'profile / fn {profile["fn"]} / payload bytes {profile["payload_bytes"]} / '
+             f'event type {profile["event_type"]} / seconds {profile["seconds"]:.3f} / '
+             f'peak traced bytes {profile["peak_traced_bytes"]}',
+             'hot functions / self ms / total ms / calls']
+
+    function_stats = sorted(pstats.Stats(profiler).stats.items(), key=lambda item: item[1][2], reverse=True)
+    for (filename, line, function_name), (_, calls, self_seconds, total_seconds, _) in function_stats[:PROFILE_TOP_N]:
+        lines.append(f'  {self_seconds * 1000:10.1f} {total_seconds * 1000:10.1f} {calls:10}  '
+                     f'{function_name} {os.path.basename(filename)}:{line}')
+
+    lines.append('retained allocations / KiB / blocks')
+    snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+    for statistic in snapshot.statistics('lineno')[:PROFILE_TOP_N]:
+        frame = statistic.traceback[0]
+        lines.append(f'  {statistic.size / 1024:10.1f} {statistic.count:10}  '
+                     f'{os.path.basename(frame.filename)}:{frame.lineno}')
+
+    summary = '\n'.join(lines)
+
+    if PROFILE_OUTPUT != 'file':
+        logging.info(summary)
+        return
+
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    event_type = re.sub(r'[^A-Za-z0-9_.-]', '_', profile['event_type'])[:80]
+    path = os.path.join(PROFILE_DIR, f'{time.time_ns()}-{event_type}-{profile["payload_bytes"]}')
+
+    with open(f'{path}.txt', 'w') as summary_file:
+        summary_file.write(summary + '\n')
+    profiler.dump_stats(f'{path}.pstats')
+    logging.info(f'profile / written / {path}.txt')
+
+    # keep the newest PROFILE_MAX_FILES profiles, /tmp is small
+
+    summaries = sorted(name for name in os.listdir(PROFILE_DIR) if name.endswith('.txt'))
+    for name in summaries[:-PROFILE_MAX_FILES]:
+        for stale in [name, name[:-len('.txt')] + '.pstats']:
+            try:
+                os.remove(os.path.join(PROFILE_DIR, stale))
+            except FileNotFoundError:
+                pass
+
 
 def assemble_otel_metrics_data(event_list: dict):
 
     resource_metrics = assemble_otel_resource_metrics_list(event_list)
+
+    if OTEL_METRIC_AGGREGATION in ['summary', 'histogram']:
+        aggregate_otel_resource_metrics_list(resource_metrics)
+
     metrics_data = MetricsData(resource_metrics=resource_metrics)
     return metrics_data
 
 
 def assemble_otel_resource_metrics_list(event_list: dict):
 
+    if GROUP_RESOURCE_METRICS is True:
+        return assemble_otel_grouped_resource_metrics_list(event_list)
+
     resource_metrics_list = []
     for event in event_list:
         resource_metrics = assemble_otel_resource_metrics(log_record=event)
@@ -89,13 +490,78 @@ def assemble_otel_resource_metrics_list(event_list: dict):
     return resource_metrics_list
 
 
+def assemble_otel_grouped_resource_metrics_list(event_list: dict):
+    """
+    Events are keyed by the serialized form of their resolved resource and scope attributes.  Events
+    sharing a key are merged under one ResourceMetrics / ScopeMetrics so the attribute sets are only sent once.
+    When COALESCE_METRIC_DATAPOINTS is set, metrics of the same series (name + unit + description) are also
+    merged into one Metric.
+    """
+
+    resource_metrics_list = []
+    resource_metrics_by_key = {}
+    scope_metrics_by_key = {}
+    metric_by_key = {}
+    merged_metric_keys = set()
+
+    for event in event_list:
+
+        if LOG_RECORD_CONTENT is True:
+            logging.info(f'OCI metric / {json.dumps(event)}')
+
+        event_values = resolve_event_values(event)
+        resource = assemble_otel_resource(event, event_values)
+        resource_key = resource.SerializeToString(deterministic=True)
+
+        resource_metrics = resource_metrics_by_key.get(resource_key)
+        if resource_metrics is None:
+            resource_metrics = ResourceMetrics(resource=resource)
+            resource_metrics_list.append(resource_metrics)
+            resource_metrics_by_key[resource_key] = resource_metrics
+
+        scope = assemble_otel_scope(event, event_values)
+        scope_key = (resource_key, scope.SerializeToString(deterministic=True))
+
+        scope_metrics = scope_metrics_by_key.get(scope_key)
+        if scope_metrics is None:
+            scope_metrics = resource_metrics.scope_metrics.add(scope=scope)
+            scope_metrics_by_key[scope_key] = scope_metrics
+
+        for metric in assemble_otel_metrics(event, event_values):
+            metric_key = scope_key + (metric.name, metric.unit, metric.description)
+            existing_metric = metric_by_key.get(metric_key)
+
+            if COALESCE_METRIC_DATAPOINTS is True and existing_metric is not None:
+                existing_metric.gauge.data_points.extend(metric.gauge.data_points)
+                merged_metric_keys.add(metric_key)
+                continue
+
+            scope_metrics.metrics.append(metric)
+            metric_by_key[metric_key] = scope_metrics.metrics[-1]
+
+    # merged series must stay ordered by timestamp
+
+    for metric_key in merged_metric_keys:
+        data_points = metric_by_key[metric_key].gauge.data_points
+        ordered = sorted(data_points, key=lambda data_point: data_point.time_unix_nano)
+        del data_points[:]
+        data_points.extend(ordered)
+
+    if LOG_RECORD_CONTENT is True:
+        for resource_metrics in resource_metrics_list:
+            logging.info(f'OTEL metric / {serialize_otel_message_to_json(resource_metrics)}')
+
+    return resource_metrics_list
+
+
 def assemble_otel_resource_metrics(log_record: dict):
 
     if LOG_RECORD_CONTENT is True:
         logging.info(f'OCI metric / {json.dumps(log_record)}')
 
-    resource = assemble_otel_resource(log_record)
-    scope_metrics = assemble_otel_scope_metrics(log_record)
+    event_values = resolve_event_values(log_record)
+    resource = assemble_otel_resource(log_record, event_values)
+    scope_metrics = assemble_otel_scope_metrics(log_record, event_values)
     resource_metrics = ResourceMetrics(resource=resource, scope_metrics=scope_metrics)
 
     if LOG_RECORD_CONTENT is True:
@@ -104,89 +570,292 @@ def assemble_otel_resource_metrics(log_record: dict):
     return resource_metrics
 
 
-def assemble_otel_scope_metrics(log_record: dict):
+def assemble_otel_scope_metrics(log_record: dict, event_values: dict = None):
 
-    scope = assemble_otel_scope(log_record)
-    metrics = assemble_otel_metrics(log_record)
+    scope = assemble_otel_scope(log_record, event_values)
+    metrics = assemble_otel_metrics(log_record, event_values)
     scope_metrics = ScopeMetrics(scope=scope, metrics=metrics)
     return [scope_metrics]
 
 
-def assemble_otel_metrics(log_record: dict):
+def assemble_otel_metrics(log_record: dict, event_values: dict = None):
+
+    if event_values is None:
+        event_values = resolve_event_values(log_record)
+
+    name = event_values.get('name')
+    display_name = event_values.get('displayName')
+    unit = event_values.get('unit')
+
+    oci_datapoints = event_values.get('datapoints')
+    timestamps, values, attributes = convert_oci_datapoints(oci_datapoints)
+
+    # coalesce the OCI data points into a single OTEL metric series, ordered by timestamp.  Data points are
+    # added in place, which avoids building each NumberDataPoint separately and copying it into the Gauge.
+
+    if COALESCE_METRIC_DATAPOINTS is True:
+        metric = Metric(name=name, description=display_name, unit=unit)
+        metric.gauge.SetInParent()
+        add_data_point = metric.gauge.data_points.add
+
+        for index in sorted(range(len(timestamps)), key=timestamps.__getitem__):
+            add_data_point(time_unix_nano=timestamps[index], as_double=values[index], attributes=attributes[index])
 
-    name = get_dictionary_value(log_record, 'name')
-    display_name = get_dictionary_value(log_record, 'displayName')
-    unit = get_dictionary_value(log_record, 'unit')
+        return [metric]
 
-    # generate an OTEL metric entry for each OCI data point
+    # otherwise, generate an OTEL metric entry for each OCI data point
 
     metrics = []
-    oci_datapoints = get_dictionary_value(log_record, 'datapoints')
-    for oci_datapoint in oci_datapoints:
-        timestamp = adjust_unix_time_to_nano(oci_datapoint.get('timestamp'))
-        attributes = assemble_otel_attributes(oci_datapoint, OTEL_DATAPOINT_ATTR_MAP)
-        data_point = NumberDataPoint(attributes=attributes)
-        data_point.time_unix_nano = timestamp
-        data_point.as_double = float(oci_datapoint.get('value'))
-        unit = unit
-        gauge = Gauge(data_points=[data_point])
-        metric = Metric(name=name, description=display_name, unit=unit, gauge=gauge)
+    for timestamp, value, data_point_attributes in zip(timestamps, values, attributes):
+        metric = Metric(name=name, description=display_name, unit=unit)
+        metric.gauge.data_points.add(time_unix_nano=timestamp, as_double=value, attributes=data_point_attributes)
         metrics.append(metric)
 
     return metrics
 
 
+def convert_oci_datapoints(oci_datapoints: list):
+    """
+    Pulls the fields of all of an event's datapoints at once, normalizing the timestamps in bulk.
+    :return: tuple of (nanosecond timestamps, float values, attribute lists), in datapoint order
+    """
+
+    timestamps = adjust_unix_times_to_nano([oci_datapoint.get('timestamp') for oci_datapoint in oci_datapoints])
+    values = [float(oci_datapoint.get('value')) for oci_datapoint in oci_datapoints]
+    attributes = assemble_otel_data_point_attributes(oci_datapoints)
+    return timestamps, values, attributes
+
+
+def assemble_otel_data_point_attributes(oci_datapoints: list):
+    """
+    OCI datapoints are flat ({timestamp, value, count}).  In a flat dictionary the first-match search reduces to
+    looking up each mapped key, so only datapoints holding nested dictionaries or lists are searched.  Flat
+    datapoints with every (bare) mapped key present share one attribute list per distinct set of values.
+    :return: list of attribute lists, in datapoint order
+    """
+
+    compiled_map = compile_attribute_map(OTEL_DATAPOINT_ATTR_MAP)
+    target_keys = [path[0] if path else target_key for target_key, _, path in compiled_map]
+    shareable = all(path is None for _, _, path in compiled_map)
+
+    attributes = []
+    attributes_by_values = {}
+    shared_attribute_count = 0
+
+    for oci_datapoint in oci_datapoints:
+        if any(isinstance(value, (dict, list)) for value in oci_datapoint.values()):
+            attributes.append(assemble_otel_attributes(oci_datapoint, OTEL_DATAPOINT_ATTR_MAP))
+            continue
+
+        datapoint_values = {key: oci_datapoint[key] for key in target_keys if oci_datapoint.get(key)}
+
+        # values are tagged with their type so that True, 1 and 1.0 are told apart
+
+        values_key = None
+        if shareable and len(datapoint_values) == len(target_keys):
+            values_key = tuple((type(value), value) for value in datapoint_values.values())
+
+        data_point_attributes = attributes_by_values.get(values_key)
+        if data_point_attributes is None:
+            data_point_attributes = assemble_otel_attributes(oci_datapoint, OTEL_DATAPOINT_ATTR_MAP, datapoint_values)
+            if values_key is not None:
+                attributes_by_values[values_key] = data_point_attributes
+        else:
+            shared_attribute_count += len(data_point_attributes)
+
+        attributes.append(data_point_attributes)
+
+    count_self_telemetry('attributes', shared_attribute_count)
+    return attributes
+
+
+def adjust_unix_times_to_nano(timestamps: list):
+    """
+    Vectorized adjust_unix_time_to_nano.  With numpy, the digit count of every timestamp is found with one
+    searchsorted over NANO_SCALE_BOUNDS and the scaling is a single uint64 multiply.  Timestamps that are not
+    all non-negative integers fall back to the per-value path.
+    """
+
+    if numpy is not None and len(timestamps) >= max(OTEL_VECTORIZE_MIN_DATAPOINTS, 1):
+        array = numpy.array(timestamps)
+
+        if array.dtype.kind in 'iu' and array.min() >= 0:
+            array = array.astype(numpy.uint64)
+            scale_index = numpy.searchsorted(numpy.array(NANO_SCALE_BOUNDS, dtype=numpy.uint64), array, side='right')
+            return (array * numpy.array(NANO_SCALES, dtype=numpy.uint64)[scale_index]).tolist()
+
+    return [adjust_unix_time_to_nano(timestamp) for timestamp in timestamps]
+
+
 def adjust_unix_time_to_nano(timestamp_int: int):
     """
     See nano unix date examples
     https://opentelemetry.io/docs/specs/otel/protocol/file-exporter/#examples
     """
 
-    # spec calls for 1*10^18
-    while timestamp_int < 1000000000000000000:
-        timestamp_int *= 10
+    # spec calls for 1*10^18: scale by the power of 10 that brings the timestamp to 19 digits
+
+    return timestamp_int * NANO_SCALES[bisect.bisect_right(NANO_SCALE_BOUNDS, timestamp_int)]
+
+
+def aggregate_otel_resource_metrics_list(resource_metrics_list: list):
+    """
+    Replaces the gauge metrics of each ScopeMetrics with one summary or histogram metric per series, per
+    OTEL_METRIC_AGGREGATION.  Gauges of the same series are folded together whether or not they were coalesced.
+    """
+
+    for resource_metrics in resource_metrics_list:
+        for scope_metrics in resource_metrics.scope_metrics:
+
+            # entries are kept in order: metrics that are not gauges as-is, gauges as their series key
+
+            entries = []
+            series_points = {}
+
+            for metric in scope_metrics.metrics:
+                if metric.WhichOneof('data') != 'gauge':
+                    entries.append(metric)
+                    continue
+
+                series_key = (metric.name, metric.unit, metric.description)
+                points = series_points.get(series_key)
+                if points is None:
+                    points = series_points[series_key] = []
+                    entries.append(series_key)
+
+                points += [(data_point.time_unix_nano, data_point.as_double if data_point.HasField('as_double')
+                            else float(data_point.as_int)) for data_point in metric.gauge.data_points]
+
+            metrics = [entry if isinstance(entry, Metric) else aggregate_otel_metric(*entry, series_points[entry])
+                       for entry in entries]
+
+            del scope_metrics.metrics[:]
+            scope_metrics.metrics.extend(metrics)
+
+
+def aggregate_otel_metric(name: str, unit: str, description: str, points: list):
+    """
+    :param points: list of (time_unix_nano, value) tuples of one series
+    :return: a summary or histogram Metric with one data point per aggregation window
+    """
+
+    window_nano = OTEL_METRIC_AGGREGATION_WINDOW_SECONDS * 1000000000
+    windows = {}
+    for time_unix_nano, value in points:
+        windows.setdefault(time_unix_nano // window_nano, []).append(value)
+
+    metric = Metric(name=name, unit=unit, description=description)
+
+    if OTEL_METRIC_AGGREGATION == 'histogram':
+        bounds = OTEL_METRIC_HISTOGRAM_BUCKETS_MAP.get(name, OTEL_METRIC_HISTOGRAM_BUCKETS)
+        metric.histogram.aggregation_temporality = AGGREGATION_TEMPORALITY_DELTA
+        metric.histogram.data_points.extend(
+            assemble_otel_histogram_data_point(window * window_nano, (window + 1) * window_nano, values, bounds)
+            for window, values in sorted(windows.items()))
+    else:
+        metric.summary.data_points.extend(
+            assemble_otel_summary_data_point(window * window_nano, (window + 1) * window_nano, values)
+            for window, values in sorted(windows.items()))
+
+    return metric
+
+
+def assemble_otel_histogram_data_point(start_time_unix_nano: int, time_unix_nano: int, values: list, bounds: list):
+    """
+    Bucket i counts the values in (bounds[i - 1], bounds[i]], the last bucket those above the last bound.
+    """
+
+    bucket_counts = [0] * (len(bounds) + 1)
+    for value in values:
+        bucket_counts[bisect.bisect_left(bounds, value)] += 1
+
+    return HistogramDataPoint(start_time_unix_nano=start_time_unix_nano, time_unix_nano=time_unix_nano,
+                              count=len(values), sum=sum(values), bucket_counts=bucket_counts,
+                              explicit_bounds=bounds, min=min(values), max=max(values))
+
+
+def assemble_otel_summary_data_point(start_time_unix_nano: int, time_unix_nano: int, values: list):
+
+    ordered = sorted(values)
+    quantile_values = [SummaryDataPoint.ValueAtQuantile(quantile=quantile, value=get_quantile(ordered, quantile))
+                       for quantile in OTEL_METRIC_SUMMARY_QUANTILES]
+
+    return SummaryDataPoint(start_time_unix_nano=start_time_unix_nano, time_unix_nano=time_unix_nano,
+                            count=len(values), sum=sum(values), quantile_values=quantile_values)
+
+
+def get_quantile(ordered: list, quantile: float):
+    """
+    Linear interpolation between the closest ranks, so quantile 0 is the minimum and 1 the maximum.
+    :param ordered: the values, sorted
+    """
 
-    return timestamp_int
+    position = quantile * (len(ordered) - 1)
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
 
 
-def assemble_otel_scope(log_record: dict):
-    attributes = assemble_otel_attributes(log_record, OTEL_METRIC_SCOPE_ATTR_MAP)
+def assemble_otel_scope(log_record: dict, event_values: dict = None):
+    attributes = assemble_otel_attributes(log_record, OTEL_METRIC_SCOPE_ATTR_MAP, event_values)
     inst_scope = InstrumentationScope(attributes=attributes)
     return inst_scope
 
 
-def assemble_otel_resource(log_record: dict):
+def assemble_otel_resource(log_record: dict, event_values: dict = None):
 
-    attributes = assemble_otel_attributes(log_record, OTEL_METRIC_RESOURCE_ATTR_MAP)
+    attributes = assemble_otel_attributes(log_record, OTEL_METRIC_RESOURCE_ATTR_MAP, event_values)
     resource = Resource(attributes=attributes)
     return resource
 
 
-def assemble_otel_attributes(log_record: dict, target_keys: list):
+def assemble_otel_attributes(log_record: dict, target_keys: list, event_values: dict = None):
+    """
+    :param event_values: values already resolved from the record by resolve_event_values, if any
+    """
 
     if len(target_keys) == 0:
         return
 
     combined_list = []
+    compiled_map = compile_attribute_map(target_keys)
 
-    for target_key in target_keys:
-        if not target_key:
-            continue
+    if event_values is None:
+        event_values = resolve_dictionary_values(log_record, [path[0] if path else target_key
+                                                              for target_key, _, path in compiled_map])
 
-        value = get_dictionary_value(log_record, target_key)
+    for target_key, attribute_key, path in compiled_map:
+
+        if path is None:
+            value = event_values.get(target_key)
+        else:
+            value = get_path_value(event_values.get(path[0]), path[1:])
 
         if isinstance(value, dict):
             for k, v in value.items():
                 combined_list.append(assemble_otel_attribute(k, v))
         else:
-            combined_list.append(assemble_otel_attribute(target_key, value))
+            combined_list.append(assemble_otel_attribute(attribute_key, value))
+
+    if OTEL_SELF_TELEMETRY is True:
+        count_self_telemetry('attributes', len(combined_list))
 
     return combined_list
 
 
 def assemble_otel_attribute(k, v):
+    """
+    The returned KeyValue may be shared through the cache.  That is safe because adding a message to a
+    repeated field copies it, but callers must not modify it.
+    """
+
+    return memoize_otel_attribute(attribute_cache, build_otel_attribute, k, v)
+
+
+def build_otel_attribute(k, v):
 
     if v is None:
+        count_self_telemetry('missing_keys')
         message = f'OCI log record key / {k} / has no value'
         if RAISE_MISSING_MAP_KEY:
             raise ValueError(message)
@@ -220,6 +889,71 @@ def assemble_otel_attribute(k, v):
         raise ValueError(f'dictionary key {k} / value is not supported yet / {v}')
 
 
+def memoize_otel_attribute(cache: OrderedDict, build, k, v):
+    """
+    :param build: function of (k, v) building the attribute on a cache miss
+    :return: the cached attribute for (k, v), or a new one when v cannot be cached
+    """
+
+    frozen_value = freeze_attribute_value(v) if OTEL_ATTRIBUTE_CACHE_SIZE > 0 else None
+    if frozen_value is None:
+        return build(k, v)
+
+    cache_key = (k, frozen_value)
+    attribute = cache.get(cache_key)
+
+    if attribute is not None:
+        cache.move_to_end(cache_key)
+        attribute_cache_stats['hits'] += 1
+        return attribute
+
+    attribute_cache_stats['misses'] += 1
+    attribute = build(k, v)
+
+    cache[cache_key] = attribute
+    if len(cache) > OTEL_ATTRIBUTE_CACHE_SIZE:
+        cache.popitem(last=False)
+
+    return attribute
+
+
+def freeze_attribute_value(v, budget: list = None):
+    """
+    Values are tagged with their type so that True, 1 and 1.0 get distinct keys.  Not cached (None returned):
+    None values, so missing keys are still reported; floats equal to zero or NaN, which compare equal to
+    values that encode differently; other types; containers over OTEL_ATTRIBUTE_CACHE_MAX_ITEMS values.
+    :param budget: single item list holding the values left for the enclosing container
+    :return: hashable form of v, or None
+    """
+
+    value_type = type(v)
+
+    if value_type is str or value_type is int or value_type is bool:
+        return value_type, v
+
+    if value_type is float:
+        return (value_type, v) if v == v and v != 0.0 else None
+
+    if value_type is not list and value_type is not dict:
+        return None
+
+    if budget is None:
+        budget = [OTEL_ATTRIBUTE_CACHE_MAX_ITEMS]
+
+    budget[0] -= len(v)
+    if budget[0] < 0:
+        return None
+
+    frozen_items = []
+    for item_key, item in (v.items() if value_type is dict else enumerate(v)):
+        frozen_item = freeze_attribute_value(item, budget)
+        if frozen_item is None:
+            return None
+        frozen_items.append((item_key, frozen_item))
+
+    return value_type, tuple(frozen_items)
+
+
 def assemble_otel_attribute_dictionary_value(k, v):
 
     kvlist = []
@@ -260,56 +994,1046 @@ def assemble_otel_attribute_list_value(k, v):
     return ArrayValue(values=values_list)
 
 
-def get_dictionary_value(dictionary: dict, target_key: str):
+def resolve_event_values(event: dict):
     """
-    Recursive method to find value within a dictionary which may also have nested lists / dictionaries.
-    :param dictionary: the dictionary to scan
-    :param target_key: the key we are looking for
-    :return: If a target_key exists multiple times in the dictionary, the first one found will be returned.
+    Resolves every key needed by the resource and scope maps (plus the metric name, displayName, unit and
+    datapoints) in one go.
+    :return: dict of {key: value} for the keys found
     """
 
-    target_value = dictionary.get(target_key)
-    if target_value:
-        return target_value
+    return resolve_dictionary_values(event, get_event_target_keys())
 
-    for key, value in dictionary.items():
-        if isinstance(value, dict):
-            target_value = get_dictionary_value(dictionary=value, target_key=target_key)
-            if target_value:
-                return target_value
 
-        elif isinstance(value, list):
-            for entry in value:
-                if isinstance(entry, dict):
-                    target_value = get_dictionary_value(dictionary=entry, target_key=target_key)
-                    if target_value:
-                        return target_value
+def get_event_target_keys():
+    """
+    :return: the distinct bare keys (or first steps of key paths) the attribute maps need from an event
+    """
 
+    maps_key = (tuple(OTEL_METRIC_RESOURCE_ATTR_MAP), tuple(OTEL_METRIC_SCOPE_ATTR_MAP))
+    target_keys = event_target_keys.get(maps_key)
 
-def send_to_otel_collector(logs_data_json):
+    if target_keys is None:
+        keys = ['name', 'displayName', 'unit', 'datapoints']
+        for target_map in maps_key:
+            keys += [path[0] if path else target_key for target_key, _, path in compile_attribute_map(target_map)]
+        target_keys = tuple(dict.fromkeys(keys))
+        event_target_keys[maps_key] = target_keys
+
+    return target_keys
+
+
+def compile_attribute_map(target_keys: list):
     """
+    Compiles an attribute map once per distinct map.  Dotted entries such as 'data.vnicId' become explicit
+    key paths (numeric steps index into lists) named after their last step; bare keys have no path.
+    :return: list of (target key, attribute key, key path or None) tuples
     """
 
-    # creating a session and adapter to avoid recreating
-    # a new connection pool between each POST call
+    compiled_key = tuple(target_keys)
+    compiled = compiled_attribute_maps.get(compiled_key)
+    if compiled is not None:
+        return compiled
 
-    session = None
+    compiled = []
+    for target_key in target_keys:
+        if not target_key:
+            continue
 
-    try:
-        session = requests.Session()
-        adapter = requests.adapters.HTTPAdapter(pool_connections=10, pool_maxsize=10)
-        session.mount('https://', adapter)
+        if '.' in target_key:
+            steps = target_key.split('.')
+            path = (steps[0],) + tuple(int(step) if step.isdigit() else step for step in steps[1:])
+            compiled.append((target_key, str(path[-1]), path))
+        else:
+            compiled.append((target_key, target_key, None))
 
-        http_headers = {'Content-type': 'application/json'}
-        post_response = session.post(API_ENDPOINT, data=logs_data_json, headers=http_headers)
+    compiled_attribute_maps[compiled_key] = compiled
+    return compiled
 
-        if post_response.status_code not in [200, 202]:
-            raise RuntimeError(f'POST Error / {post_response.status_code} / {post_response.text}')
-        else:
-            logging.info(f'POST Success / {post_response.status_code} / {post_response.text}')
 
-    finally:
-        session.close()
+def get_dictionary_shape(dictionary: dict):
+    """
+    :return: hashable fingerprint of the keys in the top two levels of the dictionary
+    """
+
+    return tuple((key, tuple(value) if isinstance(value, dict) else None) for key, value in dictionary.items())
+
+
+def resolve_dictionary_values(dictionary: dict, target_keys: list, shape: tuple = None):
+    """
+    Resolves several bare keys.  Each key uses the path learned for this event shape when it still yields
+    the first match (see get_first_match_path_value); all remaining keys are found with one first-match pass
+    over the dictionary and the paths that qualify are learned.
+    :param shape: the event shape, computed if not given
+    :return: dict of {target key: value} for the keys found
+    """
+
+    if LEARN_ATTRIBUTE_PATHS is False:
+        return get_dictionary_values(dictionary, target_keys)
+
+    if shape is None:
+        shape = get_dictionary_shape(dictionary)
+
+    target_values = {}
+    unresolved_keys = []
+
+    for target_key in target_keys:
+        learned_path = learned_key_paths.get((shape, target_key))
+        if learned_path is not None:
+            target_value = get_first_match_path_value(dictionary, learned_path, target_key)
+            if target_value is not None:
+                target_values[target_key] = target_value
+                continue
+
+        unresolved_keys.append(target_key)
+
+    if not unresolved_keys:
+        return target_values
+
+    found = find_dictionary_paths(dictionary, unresolved_keys)
+
+    if len(learned_key_paths) + len(found) > LEARNED_KEY_PATHS_MAX_SIZE:
+        learned_key_paths.clear()
+
+    for target_key, (path, target_value) in found.items():
+        if get_first_match_path_value(dictionary, path, target_key) is not None:
+            learned_key_paths[(shape, target_key)] = path
+        target_values[target_key] = target_value
+
+    return target_values
+
+
+def get_first_match_path_value(dictionary: dict, path: tuple, target_key: str):
+    """
+    The value at a learned key path is the first match only if the first-match search cannot find the key
+    before it: no dictionary along the path holds a truthy target key above it, and every value the search
+    would descend into before each step (dictionaries and lists in a dictionary, dictionaries in a list) is
+    absent.  That depends on the event's values, not only its shape, so it is checked on every use.
+    :return: the truthy value at the key path if it is the first match, else None
+    """
+
+    value = dictionary
+    for step in path[:-1]:
+        if isinstance(value, dict):
+            if value.get(target_key) or step not in value:
+                return None
+            for key, entry in value.items():
+                if key == step:
+                    break
+                if isinstance(entry, (dict, list)):
+                    return None
+
+        elif isinstance(value, list):
+            if not isinstance(step, int) or not 0 <= step < len(value) or not isinstance(value[step], dict):
+                return None
+            if any(isinstance(entry, dict) for entry in value[:step]):
+                return None
+
+        else:
+            return None
+
+        value = value[step]
+
+    if not isinstance(value, dict) or path[-1] != target_key:
+        return None
+
+    return value.get(target_key) or None
+
+
+def get_path_value(dictionary: dict, path: tuple):
+    """
+    :return: the value at the key path, or None if the path does not exist
+    """
+
+    value = dictionary
+    for step in path:
+        try:
+            value = value[step]
+        except (KeyError, IndexError, TypeError):
+            return None
+
+    return value
+
+
+def get_dictionary_value(dictionary: dict, target_key: str):
+    """
+    Recursive method to find value within a dictionary which may also have nested lists / dictionaries.
+    :param dictionary: the dictionary to scan
+    :param target_key: the key we are looking for
+    :return: If a target_key exists multiple times in the dictionary, the first one found will be returned.
+    """
+
+    return get_dictionary_values(dictionary, [target_key]).get(target_key)
+
+
+def get_dictionary_values(dictionary: dict, target_keys: list):
+    """
+    get_dictionary_value for several keys in a single pass.
+    :return: dict of {target key: first value found} for the keys found
+    """
+
+    return {target_key: target_value for target_key, (_, target_value)
+            in find_dictionary_paths(dictionary, target_keys).items()}
+
+
+def find_dictionary_paths(dictionary: dict, target_keys: list, found: dict = None, path: tuple = ()):
+    """
+    Single depth-first pass collecting the first (truthy) match of every target key, with the same precedence
+    as get_dictionary_value: a key on the current dictionary wins over nested ones, and nested dictionaries /
+    lists are visited in order.  The walk stops as soon as every key has been found.
+    :return: dict of {target key: (key path, value)} for the keys found
+    """
+
+    if found is None:
+        found = {}
+        target_keys = list(dict.fromkeys(target_keys))
+
+    for target_key in target_keys:
+        if target_key not in found:
+            target_value = dictionary.get(target_key)
+            if target_value:
+                found[target_key] = (path + (target_key,), target_value)
+
+    if len(found) == len(target_keys):
+        return found
+
+    for key, value in dictionary.items():
+        if isinstance(value, dict):
+            find_dictionary_paths(dictionary=value, target_keys=target_keys, found=found, path=path + (key,))
+            if len(found) == len(target_keys):
+                return found
+
+        elif isinstance(value, list):
+            for index, entry in enumerate(value):
+                if isinstance(entry, dict):
+                    find_dictionary_paths(dictionary=entry, target_keys=target_keys, found=found,
+                                          path=path + (key, index))
+                    if len(found) == len(target_keys):
+                        return found
+
+    return found
+
+
+def export_otel_message(message):
+    """
+    Splits the assembled message into size-bounded chunks and sends them concurrently.  Each chunk
+    succeeds or fails on its own so one bad chunk does not lose the whole batch.
+    :return: list of per-chunk result dictionaries
+    """
+
+    with time_self_telemetry_stage('chunk'):
+        chunks = list(chunk_otel_metrics(message))
+
+    if len(chunks) == 1:
+        results = [export_otel_chunk(0, *chunks[0])]
+    else:
+        with ThreadPoolExecutor(max_workers=max(1, min(OTEL_EXPORT_MAX_WORKERS, len(chunks)))) as executor:
+            results = list(executor.map(lambda indexed: export_otel_chunk(indexed[0], *indexed[1]), enumerate(chunks)))
+
+    report_otel_export_results(results)
+    return results
+
+
+def export_otel_event_stream(events):
+    """
+    Streaming pipeline: events are assembled OTEL_STREAM_BATCH_EVENTS at a time, each batch is chunked and the
+    chunks are handed to the export threads.  No more than OTEL_EXPORT_MAX_WORKERS chunks are in flight, so
+    only a batch and a few chunks are held in memory at once.  Grouping only merges events within a batch.
+    :param events: iterable of OCI events, see iterate_events
+    :return: the number of events handled
+    """
+
+    event_count = 0
+    chunk_index = 0
+    results = []
+    pending = set()
+    max_workers = max(1, OTEL_EXPORT_MAX_WORKERS)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for batch in iterate_event_batches(events, OTEL_STREAM_BATCH_EVENTS):
+            event_count += len(batch)
+            with time_self_telemetry_stage('assemble'):
+                message = assemble_otel_metrics_data(event_list=batch)
+
+            for chunk, record_count in chunk_otel_metrics(message):
+                if len(pending) >= max_workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    results += [future.result() for future in done]
+
+                pending.add(executor.submit(export_otel_chunk, chunk_index, chunk, record_count))
+                chunk_index += 1
+
+        done, _ = wait(pending)
+        results += [future.result() for future in done]
+
+    results.sort(key=lambda result: result['chunk'])
+    report_otel_export_results(results)
+    return event_count
+
+
+def iterate_event_batches(events, batch_size: int):
+    """
+    :return: generator of event lists of at most batch_size events
+    """
+
+    batch = []
+    for event in events:
+        batch.append(event)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+def iterate_events(data: io.BytesIO):
+    """
+    Decodes the payload one event at a time instead of materializing the whole event list.  A top-level
+    array is decoded element by element; a single event object is yielded as-is.  ijson reads the raw bytes
+    incrementally when installed, otherwise see decode_event_stream.
+    """
+
+    if ijson is not None:
+        data.seek(0)
+        head = data.read(64).lstrip()
+        data.seek(0)
+
+        if head.startswith(b'['):
+            yield from ijson.items(data, 'item', use_float=True)
+        else:
+            yield json.load(data)
+        return
+
+    yield from decode_event_stream(data)
+
+
+def decode_event_stream(data: io.BytesIO):
+    """
+    Standard library fallback of iterate_events.  The payload is read and UTF-8 decoded STREAM_DECODE_READ_BYTES
+    at a time, and the text of events already decoded is dropped, so the decoder holds about one event as text
+    rather than a second copy of the whole payload.  An event longer than the text buffered doubles the read size.
+    """
+
+    decoder = json.JSONDecoder()
+    utf8_decoder = codecs.getincrementaldecoder('utf-8')()
+    state = {'text': '', 'index': 0, 'consumed': 0, 'eof': False, 'read_bytes': STREAM_DECODE_READ_BYTES}
+    data.seek(0)
+
+    def read_more():
+        chunk = data.read(state['read_bytes'])
+        state['eof'] = not chunk
+        state['consumed'] += state['index']
+        state['text'] = state['text'][state['index']:] + utf8_decoder.decode(chunk, final=state['eof'])
+        state['index'] = 0
+        return not state['eof']
+
+    def peek():
+        while True:
+            state['index'] = JSON_WHITESPACE.match(state['text'], state['index']).end()
+            if state['index'] < len(state['text']) or not read_more():
+                return state['text'][state['index']:state['index'] + 1]
+
+    def decode_value():
+        while True:
+            try:
+                value, end = decoder.raw_decode(state['text'], state['index'])
+                if end < len(state['text']) or state['eof']:
+                    state['index'] = end
+                    return value
+
+            except json.JSONDecodeError:
+                if state['eof']:
+                    raise
+
+            state['read_bytes'] = max(state['read_bytes'], 2 * (len(state['text']) - state['index']))
+            read_more()
+
+    if peek() != '[':
+        yield decode_value()
+        return
+
+    state['index'] += 1
+    if peek() == ']':
+        return
+
+    while True:
+        peek()
+        yield decode_value()
+
+        separator = peek()
+        if separator == ',':
+            state['index'] += 1
+        elif separator == ']':
+            return
+        else:
+            raise ValueError(f'malformed event array / position {state["consumed"] + state["index"]}')
+
+
+def report_otel_export_results(results: list):
+    """
+    Logs the per-chunk export outcome and raises if any chunk was lost (failed without being spooled).
+    """
+
+    failed = [result for result in results if result['success'] is False]
+    logging.info(f'export / chunks {len(results)} / succeeded {len(results) - len(failed)} / failed {len(failed)}')
+
+    payload_bytes = sum(result['bytes'] for result in results)
+    sent_bytes = sum(result['sent_bytes'] for result in results)
+    compression_cpu_seconds = sum(result['compression_cpu_seconds'] for result in results)
+    logging.info(f'export / bytes {payload_bytes} / sent {sent_bytes} / '
+                 f'compression ratio {payload_bytes / max(sent_bytes, 1):.2f} / '
+                 f'compression cpu ms {compression_cpu_seconds * 1000:.1f}')
+
+    spooled = [result for result in failed if result['spooled'] is True]
+    if spooled:
+        logging.warning(f'export / chunks spooled for replay / {[result["chunk"] for result in spooled]}')
+
+    lost = [result for result in failed if result['spooled'] is False]
+    if lost:
+        raise RuntimeError(f'export failed / {len(lost)} of {len(results)} chunks / '
+                           f'{[result["chunk"] for result in lost]}')
+
+
+def start_self_telemetry():
+    """
+    Resets the self telemetry at the start of an invocation.
+    """
+
+    if OTEL_SELF_TELEMETRY is False:
+        return
+
+    with self_telemetry_lock:
+        self_telemetry['start'] = time.perf_counter()
+        self_telemetry['start_time_unix_nano'] = time.time_ns()
+        self_telemetry['counters'] = {name: 0 for name in SELF_TELEMETRY_COUNTERS}
+        self_telemetry['stages'] = {}
+
+
+def count_self_telemetry(name: str, value: int = 1):
+
+    if OTEL_SELF_TELEMETRY is False:
+        return
+
+    with self_telemetry_lock:
+        counters = self_telemetry['counters']
+        counters[name] = counters.get(name, 0) + value
+
+
+def time_self_telemetry_stage(stage: str):
+    """
+    :return: context manager adding the time spent in the 'with' block to the stage, or a shared no-op
+    context manager when self telemetry is disabled
+    """
+
+    if OTEL_SELF_TELEMETRY is False:
+        return NO_SELF_TELEMETRY_STAGE
+
+    return SelfTelemetryStageTimer(stage)
+
+
+class SelfTelemetryStageTimer:
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.start
+
+        with self_telemetry_lock:
+            stage_totals = self_telemetry['stages'].setdefault(self.stage, [0, 0.0])
+            stage_totals[0] += 1
+            stage_totals[1] += seconds
+
+
+def export_self_telemetry(ctx):
+    """
+    Sends the invocation's self telemetry to OTEL_SELF_TELEMETRY_ENDPOINT.  This is best effort: one attempt,
+    and a failure is logged without failing the invocation.
+    """
+
+    if OTEL_SELF_TELEMETRY is False:
+        return
+
+    metrics_data = assemble_self_telemetry_metrics_data(ctx.FnName())
+
+    if OTEL_EXPORT_ENCODING == 'protobuf':
+        payload, content_type = metrics_data.SerializeToString(), 'application/x-protobuf'
+    else:
+        payload, content_type = serialize_otel_message_to_json(metrics_data), 'application/json'
+
+    try:
+        post_response = get_http_session().post(OTEL_SELF_TELEMETRY_ENDPOINT, data=payload,
+                                                headers={'Content-type': content_type},
+                                                timeout=(OTEL_EXPORT_CONNECT_TIMEOUT, OTEL_EXPORT_READ_TIMEOUT))
+
+    except requests.exceptions.RequestException as ex:
+        logging.warning(f'self telemetry / POST Error / {ex}')
+        return
+
+    if post_response.status_code not in [200, 202]:
+        logging.warning(f'self telemetry / POST Error / {post_response.status_code} / {post_response.text}')
+    else:
+        logging.debug(f'self telemetry / POST Success / {post_response.status_code}')
+
+
+def assemble_self_telemetry_metrics_data(fn_name: str):
+    """
+    Counters become monotonic delta Sums over the invocation.  Stage totals become the
+    oci.function.stage.duration (seconds) and oci.function.stage.calls Sums with a 'stage' attribute.  Stages run
+    by the export threads are summed over chunks, so they can add up to more than the invocation.
+    """
+
+    with self_telemetry_lock:
+        counters = dict(self_telemetry['counters'])
+        stages = {stage: list(totals) for stage, totals in self_telemetry['stages'].items()}
+        stages['invocation'] = [1, time.perf_counter() - self_telemetry['start']]
+        start_time_unix_nano = self_telemetry['start_time_unix_nano']
+
+    time_unix_nano = time.time_ns()
+
+    def assemble_sum(name: str, unit: str, values: list):
+        data_points = [NumberDataPoint(start_time_unix_nano=start_time_unix_nano, time_unix_nano=time_unix_nano,
+                                       attributes=attributes, **{value_field: value})
+                       for attributes, value_field, value in values]
+        return Metric(name=SELF_TELEMETRY_METRIC_PREFIX + name, unit=unit,
+                      sum=Sum(data_points=data_points, aggregation_temporality=AGGREGATION_TEMPORALITY_DELTA,
+                              is_monotonic=True))
+
+    metrics = [assemble_sum(name, 'By' if name.startswith('bytes.') else '1', [([], 'as_int', value)])
+               for name, value in counters.items()]
+
+    stage_attributes = {stage: [KeyValue(key='stage', value=AnyValue(string_value=stage))] for stage in stages}
+    metrics.append(assemble_sum('stage.duration', 's', [(stage_attributes[stage], 'as_double', seconds)
+                                                       for stage, (_, seconds) in stages.items()]))
+    metrics.append(assemble_sum('stage.calls', '1', [(stage_attributes[stage], 'as_int', calls)
+                                                    for stage, (calls, _) in stages.items()]))
+
+    resource = Resource(attributes=[KeyValue(key='service.name', value=AnyValue(string_value=fn_name)),
+                                    KeyValue(key='faas.name', value=AnyValue(string_value=fn_name))])
+    scope = InstrumentationScope(name=SELF_TELEMETRY_SCOPE_NAME, version=SELF_TELEMETRY_SCOPE_VERSION)
+
+    return MetricsData(resource_metrics=[ResourceMetrics(resource=resource, scope_metrics=[
+        ScopeMetrics(scope=scope, metrics=metrics)])])
+
+
+def export_otel_chunk(index: int, chunk, record_count: int):
+    """
+    Serializes and sends one chunk.
+    :return: result dictionary for the chunk
+    """
+
+    result = {'chunk': index, 'records': record_count, 'bytes': 0, 'sent_bytes': 0,
+              'compression_cpu_seconds': 0.0, 'retries': 0, 'success': False, 'spooled': False}
+    payload, content_type, content_encoding = None, None, None
+
+    try:
+        with time_self_telemetry_stage('serialize'):
+            payload, content_type = serialize_otel_message(chunk)
+        result['bytes'] = len(payload)
+
+        # gRPC compresses on the channel, see get_grpc_export_method
+
+        if content_type != GRPC_CONTENT_TYPE:
+            with time_self_telemetry_stage('compress'):
+                payload, content_encoding, cpu_seconds = compress_otel_payload(payload)
+        else:
+            cpu_seconds = 0.0
+
+        result['sent_bytes'] = len(payload)
+        result['compression_cpu_seconds'] = cpu_seconds
+
+        if content_encoding:
+            logging.debug(f'export chunk {index} / {content_encoding} / {result["bytes"]} -> {len(payload)} bytes / '
+                          f'cpu ms {cpu_seconds * 1000:.2f}')
+
+        with time_self_telemetry_stage('export'):
+            result['retries'] = send_to_otel_collector_with_retry(payload=payload, content_type=content_type,
+                                                                  content_encoding=content_encoding)
+        result['success'] = True
+        count_self_telemetry('records', record_count)
+        count_self_telemetry('bytes.out', len(payload))
+
+    except ExportError as ex:
+        result['error'] = str(ex)
+        logging.error(f'export chunk {index} / records {record_count} / failed / {ex}')
+        count_self_telemetry('export.failures')
+
+        if ex.retryable is True:
+            result['spooled'] = spool_otel_payload(payload, content_type, content_encoding)
+
+    except Exception as ex:
+        result['error'] = str(ex)
+        logging.error(f'export chunk {index} / records {record_count} / failed / {ex}')
+        count_self_telemetry('export.failures')
+
+    return result
+
+
+def chunk_otel_metrics(metrics_data: MetricsData):
+    """
+    Splits MetricsData with the chunker for the configured encoding.
+    :return: generator of (chunk, data point count) tuples, where a chunk is a MetricsData message or, with the
+    JSON encoding, the OTLP/JSON request body
+    """
+
+    if OTEL_EXPORT_ENCODING != 'protobuf' and OTEL_EXPORT_PROTOCOL != 'grpc':
+        return chunk_otel_metrics_json(metrics_data)
+
+    return chunk_otel_metrics_data(metrics_data)
+
+
+def chunk_otel_metrics_json(metrics_data: MetricsData, max_bytes: int = None):
+    """
+    JSON counterpart of chunk_otel_metrics_data.  The OTLP/JSON body is several times larger than the protobuf
+    encoding the chunks are cut on, so each chunk is serialized and a body over OTEL_EXPORT_MAX_CHUNK_BYTES is
+    cut again, with the protobuf size limit scaled down by how much larger than the limit the body came out.
+    :param max_bytes: protobuf size limit to cut on, OTEL_EXPORT_MAX_CHUNK_BYTES by default
+    :return: generator of (OTLP/JSON request body, data point count) tuples
+    """
+
+    for chunk, record_count in chunk_otel_metrics_data(metrics_data, max_bytes):
+        body = serialize_otel_message_to_json(chunk)
+
+        if len(body) <= OTEL_EXPORT_MAX_CHUNK_BYTES or record_count <= 1:
+            yield body, record_count
+            continue
+
+        # a tenth below the scaled limit, so that a second cut is rare
+
+        yield from chunk_otel_metrics_json(chunk, int(chunk.ByteSize() * OTEL_EXPORT_MAX_CHUNK_BYTES / len(body) * 0.9))
+
+
+def chunk_otel_metrics_data(metrics_data: MetricsData, max_bytes: int = None):
+    """
+    Splits MetricsData into chunks bounded by OTEL_EXPORT_MAX_CHUNK_BYTES (encoded protobuf size, with the
+    most field framing each message can take) and OTEL_EXPORT_MAX_CHUNK_RECORDS (data points).  The resource,
+    scope and metric headers are repeated in every chunk that carries their data points.
+    :param max_bytes: size limit, OTEL_EXPORT_MAX_CHUNK_BYTES by default
+    :return: generator of (MetricsData, data point count) tuples
+    """
+
+    if max_bytes is None:
+        max_bytes = OTEL_EXPORT_MAX_CHUNK_BYTES
+
+    record_count = sum(len(getattr(metric, metric.WhichOneof('data')).data_points)
+                       for resource_metrics in metrics_data.resource_metrics
+                       for scope_metrics in resource_metrics.scope_metrics
+                       for metric in scope_metrics.metrics if metric.WhichOneof('data'))
+
+    if record_count <= OTEL_EXPORT_MAX_CHUNK_RECORDS and metrics_data.ByteSize() <= max_bytes:
+        yield metrics_data, record_count
+        return
+
+    chunk, chunk_bytes, chunk_records = MetricsData(), 0, 0
+
+    # protobuf field framing is a tag byte and a length of at most five bytes per message; each header
+    # also opens the repeated entry that holds it (e.g. ResourceMetrics for the Resource)
+
+    for resource_metrics in metrics_data.resource_metrics:
+        chunk_resource_metrics = None
+        resource_bytes = resource_metrics.resource.ByteSize() + 12
+
+        for scope_metrics in resource_metrics.scope_metrics:
+            chunk_scope_metrics = None
+            scope_bytes = scope_metrics.scope.ByteSize() + 12
+
+            for metric in scope_metrics.metrics:
+                chunk_metric = None
+                data_kind = metric.WhichOneof('data')
+                if data_kind is None:
+                    continue
+
+                metric_header = copy_otel_metric_header(metric, data_kind)
+                metric_bytes = metric_header.ByteSize() + 12
+
+                for data_point in getattr(metric, data_kind).data_points:
+
+                    record_bytes = data_point.ByteSize() + 6
+                    header_bytes = (resource_bytes if chunk_resource_metrics is None else 0) + \
+                                   (scope_bytes if chunk_scope_metrics is None else 0) + \
+                                   (metric_bytes if chunk_metric is None else 0)
+
+                    if chunk_records > 0 and (chunk_records >= OTEL_EXPORT_MAX_CHUNK_RECORDS or
+                                              chunk_bytes + header_bytes + record_bytes > max_bytes):
+                        yield chunk, chunk_records
+                        chunk, chunk_bytes, chunk_records = MetricsData(), 0, 0
+                        chunk_resource_metrics, chunk_scope_metrics, chunk_metric = None, None, None
+
+                    if chunk_resource_metrics is None:
+                        chunk_resource_metrics = chunk.resource_metrics.add(resource=resource_metrics.resource,
+                                                                            schema_url=resource_metrics.schema_url)
+                        chunk_bytes += resource_bytes
+
+                    if chunk_scope_metrics is None:
+                        chunk_scope_metrics = chunk_resource_metrics.scope_metrics.add(scope=scope_metrics.scope,
+                                                                                       schema_url=scope_metrics.schema_url)
+                        chunk_bytes += scope_bytes
+
+                    if chunk_metric is None:
+                        chunk_scope_metrics.metrics.append(metric_header)
+                        chunk_metric = chunk_scope_metrics.metrics[-1]
+                        chunk_bytes += metric_bytes
+
+                    getattr(chunk_metric, data_kind).data_points.append(data_point)
+                    chunk_bytes += record_bytes
+                    chunk_records += 1
+
+    if chunk_records > 0:
+        yield chunk, chunk_records
+
+
+def copy_otel_metric_header(metric: Metric, data_kind: str):
+    """
+    :return: a copy of the metric without its data points
+    """
+
+    header = Metric(name=metric.name, description=metric.description, unit=metric.unit)
+    source = getattr(metric, data_kind)
+    target = getattr(header, data_kind)
+    target.SetInParent()
+
+    if data_kind in ['sum', 'histogram', 'exponential_histogram']:
+        target.aggregation_temporality = source.aggregation_temporality
+
+    if data_kind == 'sum':
+        target.is_monotonic = source.is_monotonic
+
+    return header
+
+
+def compress_otel_payload(payload):
+    """
+    Compresses the request body per OTEL_EXPORT_COMPRESSION.  Bodies smaller than
+    OTEL_EXPORT_COMPRESSION_MIN_BYTES are not worth the CPU and are returned as-is.
+    :return: tuple of (body, Content-Encoding or None, compression cpu seconds)
+    """
+
+    codec = OTEL_EXPORT_COMPRESSION
+    if codec == 'zstd' and zstandard is None:
+        codec = 'gzip'
+
+    if codec not in ['gzip', 'zstd'] or len(payload) < OTEL_EXPORT_COMPRESSION_MIN_BYTES:
+        return payload, None, 0.0
+
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+
+    start = time.thread_time()
+
+    if codec == 'zstd':
+        body = zstandard.ZstdCompressor(level=OTEL_EXPORT_COMPRESSION_LEVEL).compress(payload)
+    else:
+        body = gzip.compress(payload, compresslevel=min(max(OTEL_EXPORT_COMPRESSION_LEVEL, 0), 9), mtime=0)
+
+    return body, codec, time.thread_time() - start
+
+
+class ExportError(RuntimeError):
+    """
+    Raised when the collector rejects or cannot be reached for an export.
+    :param retryable: True for connection failures and RETRYABLE_STATUS_CODES
+    :param retry_after: seconds requested by the collector's Retry-After header, if any
+    """
+
+    def __init__(self, message, retryable=False, retry_after=None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+def send_to_otel_collector_with_retry(payload, content_type='application/json', content_encoding=None):
+    """
+    Retries retryable export failures with exponential backoff and full jitter.  A Retry-After longer than
+    OTEL_EXPORT_BACKOFF_MAX_SECONDS is not waited out in the function; the error is raised instead.
+    :return: the number of retries it took
+    """
+
+    attempt = 0
+
+    while True:
+        try:
+            send_to_otel_collector(payload=payload, content_type=content_type, content_encoding=content_encoding)
+            return attempt
+
+        except ExportError as ex:
+            if ex.retryable is False or attempt >= OTEL_EXPORT_MAX_RETRIES:
+                raise
+
+            if ex.retry_after is not None:
+                if ex.retry_after > OTEL_EXPORT_BACKOFF_MAX_SECONDS:
+                    raise
+                delay = ex.retry_after
+            else:
+                delay = random.uniform(0, min(OTEL_EXPORT_BACKOFF_MAX_SECONDS, OTEL_EXPORT_BACKOFF_SECONDS * 2 ** attempt))
+
+            attempt += 1
+            count_self_telemetry('export.retries')
+            logging.warning(f'export retry {attempt} of {OTEL_EXPORT_MAX_RETRIES} / waiting {delay:.2f}s / {ex}')
+            time.sleep(delay)
+
+
+def send_to_otel_collector(payload, content_type='application/json', content_encoding=None, timeout_seconds=None):
+    """
+    :param payload: the encoded request body
+    :param content_type: 'application/json', 'application/x-protobuf' or GRPC_CONTENT_TYPE
+    :param content_encoding: 'gzip', 'zstd' or None when the payload is not compressed
+    :param timeout_seconds: shorter read timeout (gRPC deadline) than the configured one, or None
+    """
+
+    if content_type == GRPC_CONTENT_TYPE:
+        return send_to_otel_collector_grpc(payload, timeout_seconds)
+
+    http_headers = {'Content-type': content_type}
+    if content_encoding:
+        http_headers['Content-Encoding'] = content_encoding
+    timeout = (OTEL_EXPORT_CONNECT_TIMEOUT, OTEL_EXPORT_READ_TIMEOUT) if timeout_seconds is None \
+        else (min(OTEL_EXPORT_CONNECT_TIMEOUT, timeout_seconds), min(OTEL_EXPORT_READ_TIMEOUT, timeout_seconds))
+
+    # a keep-alive connection the collector closed while the container was frozen is dropped from the pool by
+    # urllib3; a POST that still fails on one is retried by send_to_otel_collector_with_retry
+
+    try:
+        post_response = get_http_session().post(API_ENDPOINT, data=payload, headers=http_headers, timeout=timeout)
+
+    except requests.exceptions.RequestException as ex:
+        raise ExportError(f'POST Error / {ex}', retryable=True)
+
+    if post_response.status_code not in [200, 202]:
+        raise ExportError(f'POST Error / {post_response.status_code} / {post_response.text}',
+                          retryable=post_response.status_code in RETRYABLE_STATUS_CODES,
+                          retry_after=parse_retry_after(post_response.headers.get('Retry-After')))
+    else:
+        logging.info(f'POST Success / {post_response.status_code} / {post_response.text}')
+
+
+def send_to_otel_collector_grpc(payload: bytes, timeout_seconds: float = None):
+    """
+    Calls MetricsService/Export with the already serialized request.  MetricsData and
+    ExportMetricsServiceRequest share the same wire format, so the MetricsData bytes are sent as-is.
+    """
+
+    if grpc is None:
+        raise ExportError('gRPC Error / OTEL_EXPORT_PROTOCOL is grpc but grpcio is not installed')
+
+    deadline_seconds = OTEL_EXPORT_GRPC_DEADLINE_SECONDS if timeout_seconds is None \
+        else min(OTEL_EXPORT_GRPC_DEADLINE_SECONDS, timeout_seconds)
+
+    # a request over the channel limit would fail with RESOURCE_EXHAUSTED, which must not be retried here
+
+    if len(payload) > OTEL_EXPORT_GRPC_MAX_MESSAGE_BYTES:
+        raise ExportError(f'gRPC Error / {len(payload)} bytes exceeds OTEL_EXPORT_GRPC_MAX_MESSAGE_BYTES')
+
+    try:
+        export_response = get_grpc_export_method()(payload, timeout=deadline_seconds)
+
+    except grpc.RpcError as ex:
+        raise ExportError(f'gRPC Error / {ex.code().name} / {ex.details()}',
+                          retryable=ex.code().name in RETRYABLE_GRPC_STATUS_CODES)
+
+    partial_success = export_response.partial_success
+    if partial_success.rejected_data_points > 0:
+        logging.warning(f'gRPC partial success / rejected data points {partial_success.rejected_data_points} / '
+                        f'{partial_success.error_message}')
+    else:
+        logging.info(f'gRPC Success / {len(payload)} bytes')
+
+
+def parse_retry_after(retry_after: str):
+    """
+    :param retry_after: Retry-After header value, either delay seconds or an HTTP date
+    :return: seconds to wait, or None if absent or unparseable
+    """
+
+    if not retry_after:
+        return None
+
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+
+    try:
+        return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def spool_otel_payload(payload, content_type, content_encoding):
+    """
+    Writes an encoded export that could not be delivered to the spool directory.  Each spool file is a JSON
+    header line (content type and encoding) followed by the request body.  The oldest files are dropped to
+    keep the spool within OTEL_EXPORT_SPOOL_MAX_BYTES.
+    :return: True if the payload was spooled
+    """
+
+    if payload is None or OTEL_EXPORT_SPOOL_MAX_BYTES <= 0:
+        return False
+
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+
+    header = json.dumps({'content_type': content_type, 'content_encoding': content_encoding}).encode('utf-8')
+    record = header + b'\n' + payload
+
+    if len(record) > OTEL_EXPORT_SPOOL_MAX_BYTES:
+        logging.error(f'spool / payload larger than spool / {len(record)} bytes / dropped')
+        return False
+
+    try:
+        with spool_lock:
+            os.makedirs(OTEL_EXPORT_SPOOL_DIR, exist_ok=True)
+
+            spool_files = list_spool_files()
+            spool_bytes = sum(size for _, size in spool_files)
+            while spool_files and spool_bytes + len(record) > OTEL_EXPORT_SPOOL_MAX_BYTES:
+                oldest_path, oldest_size = spool_files.pop(0)
+                os.remove(oldest_path)
+                spool_bytes -= oldest_size
+                logging.warning(f'spool / full / dropped oldest / {oldest_path}')
+
+            path = os.path.join(OTEL_EXPORT_SPOOL_DIR, f'{time.time_ns()}-{uuid.uuid4().hex}.otlp')
+            with open(path + '.tmp', 'wb') as f:
+                f.write(record)
+            os.replace(path + '.tmp', path)
+
+        logging.info(f'spool / saved / {path} / {len(payload)} bytes')
+        return True
+
+    except OSError as ex:
+        logging.error(f'spool / write failed / {ex}')
+        return False
+
+
+def list_spool_files():
+    """
+    :return: list of (path, size) tuples for the spooled payloads, oldest first
+    """
+
+    if not os.path.isdir(OTEL_EXPORT_SPOOL_DIR):
+        return []
+
+    names = sorted(name for name in os.listdir(OTEL_EXPORT_SPOOL_DIR) if name.endswith('.otlp'))
+    paths = [os.path.join(OTEL_EXPORT_SPOOL_DIR, name) for name in names]
+    return [(path, os.path.getsize(path)) for path in paths]
+
+
+def replay_otel_spool():
+    """
+    Re-sends spooled payloads, oldest first, before the current batch is handled.  Replay stops at the first
+    retryable failure (the collector is still unhealthy), after OTEL_EXPORT_SPOOL_REPLAY_MAX_FILES files or
+    when OTEL_EXPORT_SPOOL_REPLAY_MAX_SECONDS are used up, and leaves the remaining files for a later invocation.
+    Payloads the collector rejects outright are discarded.
+    """
+
+    with spool_lock:
+        spool_files = list_spool_files()
+
+    if not spool_files:
+        return
+
+    deadline = time.monotonic() + OTEL_EXPORT_SPOOL_REPLAY_MAX_SECONDS
+    replay_files = spool_files[:max(0, OTEL_EXPORT_SPOOL_REPLAY_MAX_FILES)]
+    logging.info(f'spool / replaying {len(replay_files)} of {len(spool_files)} payloads')
+
+    for path, _ in replay_files:
+        remaining_seconds = deadline - time.monotonic()
+        if remaining_seconds <= 0:
+            logging.warning(f'spool / replay time limit reached / {OTEL_EXPORT_SPOOL_REPLAY_MAX_SECONDS} s')
+            return
+
+        try:
+            with open(path, 'rb') as f:
+                header = json.loads(f.readline())
+                payload = f.read()
+
+            send_to_otel_collector(payload=payload, content_type=header['content_type'],
+                                   content_encoding=header['content_encoding'], timeout_seconds=remaining_seconds)
+
+        except ExportError as ex:
+            if ex.retryable is True:
+                logging.warning(f'spool / replay deferred / {path} / {ex}')
+                return
+            logging.error(f'spool / replay rejected / discarding {path} / {ex}')
+
+        except (OSError, ValueError, KeyError) as ex:
+            logging.error(f'spool / unreadable / discarding {path} / {ex}')
+
+        with spool_lock:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def get_http_session():
+    """
+    Lazily creates the module-level session.  Its connection pool survives across hot invocations of the
+    same function container.
+    """
+
+    global http_session
+
+    with http_session_lock:
+        if http_session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=OTEL_EXPORT_POOL_SIZE,
+                                                    pool_maxsize=OTEL_EXPORT_POOL_SIZE)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            http_session = session
+
+        return http_session
+
+
+def get_grpc_export_method():
+    """
+    Lazily creates the module-level channel and the MetricsService/Export callable bound to it.  The channel
+    reconnects on its own, so it is kept across hot invocations of the same function container.
+    """
+
+    global grpc_channel, grpc_export_method
+
+    with grpc_channel_lock:
+        if grpc_channel is None:
+            options = [('grpc.max_send_message_length', OTEL_EXPORT_GRPC_MAX_MESSAGE_BYTES),
+                       ('grpc.max_receive_message_length', OTEL_EXPORT_GRPC_MAX_MESSAGE_BYTES)]
+            compression = grpc.Compression.Gzip if OTEL_EXPORT_COMPRESSION in ['gzip', 'zstd'] else None
+
+            if GRPC_ENDPOINT.startswith('https://'):
+                grpc_channel = grpc.secure_channel(GRPC_ENDPOINT[len('https://'):], grpc.ssl_channel_credentials(),
+                                                   options=options, compression=compression)
+            else:
+                grpc_channel = grpc.insecure_channel(GRPC_ENDPOINT.replace('http://', '', 1),
+                                                     options=options, compression=compression)
+
+            method = METRICS_SERVICE_DESCRIPTOR.services_by_name['MetricsService'].methods_by_name['Export']
+            grpc_export_method = grpc_channel.unary_unary(f'/{method.containing_service.full_name}/{method.name}',
+                                                          request_serializer=None,
+                                                          response_deserializer=ExportMetricsServiceResponse.FromString)
+
+        return grpc_export_method
+
+
+def serialize_otel_message(message):
+    """
+    Encodes the MetricsData message per OTEL_EXPORT_PROTOCOL and OTEL_EXPORT_ENCODING.  The binary encoding
+    skips the intermediate dictionary and JSON string copies of the message tree.
+    :return: tuple of the request body and its content type
+    """
+
+    if OTEL_EXPORT_PROTOCOL == 'grpc':
+        return message.SerializeToString(), GRPC_CONTENT_TYPE
+
+    if isinstance(message, str):
+        return message, 'application/json'
+
+    if OTEL_EXPORT_ENCODING == 'protobuf':
+        return message.SerializeToString(), 'application/x-protobuf'
+
+    return serialize_otel_message_to_json(message), 'application/json'
 
 
 def serialize_otel_message_to_json(logs_data: LogsData, use_indention=False):
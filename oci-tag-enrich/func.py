@@ -4,10 +4,23 @@
 # Copyright (c) 2023, Oracle and/or its affiliates. All rights reserved.
 # Licensed under the Universal Permissive License v 1.0 as shown at https://oss.oracle.com/licenses/upl.
 
+import cProfile
+import functools
+import gzip
 import io
 import json
 import logging
+import math
 import os
+import pstats
+import random
+import re
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 import oci
 from fdk import response
 
@@ -60,6 +73,17 @@ include_freeform_tags = eval(os.getenv('INCLUDE_FREEFORM_TAGS', "True"))
 include_defined_tags = eval(os.getenv('INCLUDE_DEFINED_TAGS', "True"))
 include_system_tags = eval(os.getenv('INCLUDE_SYSTEM_TAGS', "True"))
 
+"""
+Sampled profiling: a PROFILE_SAMPLE_RATE fraction of invocations (0 disables, 1 profiles every one) runs under
+cProfile and tracemalloc.  The PROFILE_TOP_N hottest functions and allocation sites are reported with the payload
+size and the first event type (or metric namespace): logged, or written to PROFILE_DIR when PROFILE_OUTPUT is 'file'.
+"""
+
+profile_sample_rate = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+profile_top_n = int(os.getenv('PROFILE_TOP_N', '15'))
+profile_output = os.getenv('PROFILE_OUTPUT', 'log')
+profile_dir = os.getenv('PROFILE_DIR', '/tmp/function-profiles')
+
 """
 The OCI Search API performs the look-up for us.  Resource principal permissions must be
 granted to the task function 'resource' for it to have access.
@@ -67,8 +91,74 @@ granted to the task function 'resource' for it to have access.
 See: https://docs.oracle.com/en-us/iaas/Content/connector-hub/overview.htm#Authenti
 """
 
-signer = oci.auth.signers.get_resource_principals_signer()
-search_client = oci.resource_search.ResourceSearchClient(config={}, signer=signer)
+signer = None
+signer_lock = threading.Lock()
+search_clients = threading.local()
+
+"""
+Searches run on one executor of TAG_SEARCH_MAX_WORKERS threads kept for the container's life, so the search
+clients of its threads (and their connections) are reused by later invocations.  Between invocations the
+threads are idle: every invocation waits for the searches it started.
+"""
+
+search_executor = None
+search_executor_lock = threading.Lock()
+
+"""
+OCIDs not in the tag cache are looked up before the events are tagged: every uncached OCID in the payload is
+collected first, combined into queries of up to TAG_SEARCH_BATCH_SIZE OCIDs each and searched concurrently by up
+to TAG_SEARCH_MAX_WORKERS threads.  TAG_SEARCH_RATE_LIMIT optionally caps the Search API requests per second across
+those threads (0, the default, for no limit).
+
+OCIDs come from the payload and are written into the query text, so only values in the OCID format are searched;
+others are logged and cached as not found.  The same goes for the warm-up compartments and resource types.
+"""
+
+ocid_pattern = re.compile(r'ocid1\.[a-z0-9._-]+')
+resource_type_pattern = re.compile(r'[A-Za-z][A-Za-z0-9]*')
+tag_search_batch_size = int(os.getenv('TAG_SEARCH_BATCH_SIZE', '20'))
+tag_search_max_workers = int(os.getenv('TAG_SEARCH_MAX_WORKERS', '8'))
+tag_search_rate_limit = float(os.getenv('TAG_SEARCH_RATE_LIMIT', '0'))
+search_rate_lock = threading.Lock()
+search_rate_state = {'next_request': 0.0}
+
+"""
+Looked-up tags are cached across the invocations of a warm container.  The cache holds at most
+TAG_CACHE_MAX_ENTRIES OCIDs and TAG_CACHE_MAX_BYTES of tags (measured as JSON), evicting the least recently used
+first; 0 disables either limit.  Entries expire TAG_CACHE_TTL_SECONDS after their look-up (0 for never).  For
+TAG_CACHE_STALE_SECONDS past that, an expired entry is still used while it is looked up again on the search
+threads.  Fn freezes the container once the handler returns, so the handler first waits up to
+TAG_CACHE_REFRESH_WAIT_SECONDS for the invocation's refreshes.  Refreshes not started by then are dropped and their
+entries stay stale for a later invocation; a search already running is waited for.
+
+OCIDs the Search API finds nothing for are cached as empty tags for the shorter TAG_CACHE_NEGATIVE_TTL_SECONDS.
+With TAG_CACHE_ERROR_BACKOFF_SECONDS set, OCIDs whose look-up failed are cached as empty tags for that long,
+doubling with every consecutive failure up to TAG_CACHE_ERROR_BACKOFF_MAX_SECONDS, and the events are passed on
+without their tags.  With 0, a failed look-up fails the invocation.
+"""
+
+tag_cache_max_entries = int(os.getenv('TAG_CACHE_MAX_ENTRIES', '10000'))
+tag_cache_max_bytes = int(os.getenv('TAG_CACHE_MAX_BYTES', '0'))
+tag_cache_ttl_seconds = float(os.getenv('TAG_CACHE_TTL_SECONDS', '3600'))
+tag_cache_stale_seconds = float(os.getenv('TAG_CACHE_STALE_SECONDS', '300'))
+tag_cache_refresh_wait_seconds = float(os.getenv('TAG_CACHE_REFRESH_WAIT_SECONDS', '2'))
+tag_cache_negative_ttl_seconds = float(os.getenv('TAG_CACHE_NEGATIVE_TTL_SECONDS', '300'))
+tag_cache_error_backoff_seconds = float(os.getenv('TAG_CACHE_ERROR_BACKOFF_SECONDS', '30'))
+tag_cache_error_backoff_max_seconds = float(os.getenv('TAG_CACHE_ERROR_BACKOFF_MAX_SECONDS', '600'))
+
+"""
+Warm start: on its first invocation, a container loads the tag cache from the snapshot at TAG_SNAPSHOT_PATH
+(gzip compressed if the name ends in .gz).  Point it at a mounted path to share the snapshot across containers.
+Without a usable snapshot, the cache is warmed up with the tags of every resource in TAG_WARMUP_COMPARTMENTS
+(comma-separated compartment OCIDs), one paged search per compartment and TAG_WARMUP_TYPES resource type ('all'
+for every type).  The snapshot is then written, and rewritten after invocations that changed the cache, at most every
+TAG_SNAPSHOT_INTERVAL_SECONDS.
+"""
+
+tag_snapshot_path = os.getenv('TAG_SNAPSHOT_PATH', '')
+tag_snapshot_interval_seconds = float(os.getenv('TAG_SNAPSHOT_INTERVAL_SECONDS', '300'))
+tag_warmup_compartments = [c for c in os.getenv('TAG_WARMUP_COMPARTMENTS', '').split(',') if c.strip()]
+tag_warmup_types = os.getenv('TAG_WARMUP_TYPES', 'all').split(',')
 
 """
 Set all registered loggers to the configured log_level
@@ -79,16 +169,80 @@ loggers = [logging.getLogger()] + [logging.getLogger(name) for name in logging.r
 [logger.setLevel(logging.getLevelName(logging_level)) for logger in loggers]
 
 """
-The cache avoids having to lookup OCID tags more than once.
+The cache avoids having to lookup OCID tags more than once:
+{target_ocid: (tags, target_ocid_key, expires at, size in bytes, kind, consecutive failures)}, least recently used
+first.  The kind is 'tags', 'negative' (nothing found) or 'error' (look-up failed).  Look-ups in progress are
+tracked in {target_ocid: (Future, is refresh)} so that an OCID is only searched once at a time.  The futures of the
+invocation's refreshes are kept until the handler waits for them, which sets the refresh deadline.
+Counters are cumulative over the container's life and logged with each invocation.
 """
 
-tag_cache = {}
+tag_cache = OrderedDict()
+tag_cache_lock = threading.Lock()
+tag_cache_state = {'bytes': 0, 'changes': 0, 'initialized': False, 'snapshot_changes': 0, 'snapshot_at': 0.0}
+tag_cache_stats = {'hits': 0, 'stale_hits': 0, 'negative_hits': 0, 'error_hits': 0, 'misses': 0, 'coalesced': 0,
+                   'expirations': 0, 'evictions': 0, 'lookup_failures': 0, 'refreshes': 0, 'refresh_failures': 0,
+                   'refreshes_dropped': 0, 'invalid_ocids': 0}
+tag_lookups_in_flight = {}
+tag_refresh_state = {'futures': set(), 'deadline': None}
+
+"""
+Profiled invocations are keyed by the first event type or metric namespace found in the head of the payload.
+"""
+
+event_type_pattern = re.compile(rb'"(?:type|namespace)"\s*:\s*"([^"]*)"')
+profile_peek_bytes = 65536
+profile_max_files = 20
 
 # -------------------------------------------
 # Functions
 # -------------------------------------------
 
 
+def profile_sampled_invocations(handler_function):
+    """
+    Runs a profile_sample_rate fraction of the decorated handler's invocations under cProfile and tracemalloc
+    and reports them with report_invocation_profile.  Other invocations only pay for the sampling check.
+    """
+
+    @functools.wraps(handler_function)
+    def sampled_handler(ctx, data: io.BytesIO = None):
+
+        if profile_sample_rate <= 0 or random.random() >= profile_sample_rate:
+            return handler_function(ctx, data)
+
+        payload = data.getvalue() if data is not None else b''
+        profile = {'fn': ctx.FnName(), 'payload_bytes': len(payload), 'event_type': peek_event_type(payload)}
+
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        profiler.enable()
+
+        try:
+            return handler_function(ctx, data)
+
+        finally:
+            profiler.disable()
+            profile['seconds'] = time.perf_counter() - start
+            profile['peak_traced_bytes'] = tracemalloc.get_traced_memory()[1]
+            snapshot = tracemalloc.take_snapshot()
+            if started_tracing:
+                tracemalloc.stop()
+
+            try:
+                report_invocation_profile(profile, profiler, snapshot)
+            except Exception as ex:
+                logging.warning(f'profile / report failed / {ex}')
+
+    return sampled_handler
+
+
+@profile_sampled_invocations
 def handler(ctx, data: io.BytesIO = None):
     """
     OCI Function Entry Point
@@ -102,7 +256,9 @@ def handler(ctx, data: io.BytesIO = None):
     try:
         payload = json.loads(data.getvalue())
         logging.getLogger().info(preamble.format(ctx.FnName(), len(payload), logging_level))
+        initialize_tag_cache()
         add_tags_to_payload(payload)
+        save_tag_snapshot()
 
         return response.Response(ctx,
                                  status_code=200,
@@ -113,21 +269,566 @@ def handler(ctx, data: io.BytesIO = None):
         logging.getLogger().error(f'error handling task function payload: {ex}')
         raise
 
+    finally:
+        logging.getLogger().info(
+            f'tag cache / entries {len(tag_cache)} / bytes {tag_cache_state["bytes"]} / '
+            + ' / '.join(f'{name.replace("_", " ")} {count}' for name, count in tag_cache_stats.items()))
+
+
+def peek_event_type(payload: bytes):
+    """
+    :return: the first event_type_pattern match in the head of the raw payload, without decoding it
+    """
+
+    match = event_type_pattern.search(payload, 0, profile_peek_bytes)
+    return match.group(1).decode('utf-8', 'replace') if match else 'unknown'
+
+
+def report_invocation_profile(profile: dict, profiler, snapshot):
+    """
+    Summarizes a profiled invocation: the profile_top_n functions with the most self time (handler thread
+    only), and the profile_top_n source lines holding the most memory allocated during the invocation and still
+    live at its end.  The summary is logged, or written to profile_dir together with the raw cProfile stats
+    when profile_output is 'file'.
+    """
+
+    lines = [f'profile / fn {profile["fn"]} / payload bytes {profile["payload_bytes"]} / '
+             f'event type {profile["event_type"]} / seconds {profile["seconds"]:.3f} / '
+             f'peak traced bytes {profile["peak_traced_bytes"]}',
+             'hot functions / self ms / total ms / calls']
+
+    function_stats = sorted(pstats.Stats(profiler).stats.items(), key=lambda item: item[1][2], reverse=True)
+    for (filename, line, function_name), (_, calls, self_seconds, total_seconds, _) in function_stats[:profile_top_n]:
+        lines.append(f'  {self_seconds * 1000:10.1f} {total_seconds * 1000:10.1f} {calls:10}  '
+                     f'{function_name} {os.path.basename(filename)}:{line}')
+
+    lines.append('retained allocations / KiB / blocks')
+    snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+    for statistic in snapshot.statistics('lineno')[:profile_top_n]:
+        frame = statistic.traceback[0]
+        lines.append(f'  {statistic.size / 1024:10.1f} {statistic.count:10}  '
+                     f'{os.path.basename(frame.filename)}:{frame.lineno}')
+
+    summary = '\n'.join(lines)
+
+    if profile_output != 'file':
+        logging.info(summary)
+        return
+
+    os.makedirs(profile_dir, exist_ok=True)
+    event_type = re.sub(r'[^A-Za-z0-9_.-]', '_', profile['event_type'])[:80]
+    path = os.path.join(profile_dir, f'{time.time_ns()}-{event_type}-{profile["payload_bytes"]}')
+
+    with open(f'{path}.txt', 'w') as summary_file:
+        summary_file.write(summary + '\n')
+    profiler.dump_stats(f'{path}.pstats')
+    logging.info(f'profile / written / {path}.txt')
+
+    # keep the newest profile_max_files profiles, /tmp is small
+
+    summaries = sorted(name for name in os.listdir(profile_dir) if name.endswith('.txt'))
+    for name in summaries[:-profile_max_files]:
+        for stale in [name, name[:-len('.txt')] + '.pstats']:
+            try:
+                os.remove(os.path.join(profile_dir, stale))
+            except FileNotFoundError:
+                pass
+
 
 def add_tags_to_payload(payload):
     """
+    Target OCIDs are found in one walk per event.  Uncached OCIDs of the whole payload are then looked up
+    together (see prefetch_ocid_tags) before a second pass tags the events from the cache.  Stale OCIDs are
+    refreshed meanwhile, and finished with (see finish_tag_refreshes) before returning.
     :param payload: payload is either a single event dictionary or a list of events.
     :return: the original payload (single event or list) with tags added.
     """
 
-    if isinstance(payload, list):
-        for event in payload:
-            tag_collection = assemble_event_tags(event)
+    events = payload if isinstance(payload, list) else [payload]
+    event_target_ocids = [get_dictionary_values(event, target_ocid_keys) for event in events]
+
+    try:
+        ocid_tags = prefetch_ocid_tags(event_target_ocids)
+
+        for event, target_ocids in zip(events, event_target_ocids):
+            tag_collection = assemble_event_tags(event, target_ocids, ocid_tags)
             position_tags_on_event(event, tag_collection)
 
+    finally:
+        finish_tag_refreshes()
+
+
+def prefetch_ocid_tags(event_target_ocids: list):
+    """
+    Gets the tags of every OCID in the payload: from the tag cache, then by looking up the rest,
+    tag_search_batch_size OCIDs per query and queries concurrently.  An OCID found under several keys is looked
+    up once, under the first key in event and target_ocid_keys order, as the event-by-event lookup would.
+    Stale cached OCIDs are used as they are and refreshed on the search threads, queued after the look-ups
+    so they do not hold them up.  If any lookup fails (and
+    tag_cache_error_backoff_seconds is 0), the others are still cached and the first error is raised.
+    :param event_target_ocids: list of {target_ocid_key: target_ocid} dictionaries, one per event
+    :return: dictionary of {target_ocid: tags}, independent of what the cache evicts meanwhile
+    """
+
+    ocid_tags = {}
+    uncached = {}
+    stale = {}
+
+    for target_ocids in event_target_ocids:
+        for target_ocid_key in target_ocid_keys:
+            target_ocid = target_ocids.get(target_ocid_key)
+            if not isinstance(target_ocid, str) or target_ocid in ocid_tags or target_ocid in uncached:
+                continue
+
+            cached_tags, is_stale = lookup_cached_tags(target_ocid, target_ocid_key)
+            if cached_tags is None:
+                uncached[target_ocid] = target_ocid_key
+                continue
+
+            ocid_tags[target_ocid] = cached_tags
+            if is_stale:
+                stale[target_ocid] = target_ocid_key
+
+    refresh_lookups = [(target_ocid_key, target_ocid) for target_ocid, target_ocid_key in stale.items()]
+    lookups = [(target_ocid_key, target_ocid) for target_ocid, target_ocid_key in uncached.items()]
+
+    # a single batch is searched on the calling thread, several on the search threads ahead of the refreshes
+
+    concurrent = tag_search_max_workers > 1 and len(lookups) > max(1, tag_search_batch_size)
+    logging.debug(f'prefetch / ocids {len(lookups)} / stale {len(refresh_lookups)} / concurrent {concurrent}')
+
+    if refresh_lookups and not concurrent:
+        refresh_stale_tags(refresh_lookups)
+
+    futures = start_tag_lookups(lookups, get_search_executor() if concurrent else None)
+
+    if refresh_lookups and concurrent:
+        refresh_stale_tags(refresh_lookups)
+
+    first_error = None
+    for target_ocid, future in futures.items():
+        error = future.exception()
+        if error is None:
+            ocid_tags[target_ocid] = future.result()[target_ocid]
+        elif first_error is None:
+            first_error = error
+
+    if first_error is not None:
+        raise first_error
+
+    return ocid_tags
+
+
+def batch_lookups(lookups: list):
+    """
+    :return: the (target_ocid_key, target_ocid) lookups split into lists of up to tag_search_batch_size
+    """
+
+    batch_size = max(1, tag_search_batch_size)
+    return [lookups[index:index + batch_size] for index in range(0, len(lookups), batch_size)]
+
+
+def start_tag_lookups(lookups: list, executor=None, refresh: bool = False):
+    """
+    Single-flight look-ups: an OCID that is already being looked up joins that look-up instead of searching
+    again.  Only refreshes join refreshes: a refresh may be dropped or still queued behind the refresh deadline,
+    so a look-up for tags the events are waiting on searches on its own.  The others are searched in batches, on
+    'executor' or else on the calling thread, and cached by finish_tag_lookup.
+    :param lookups: list of (target_ocid_key, target_ocid) tuples
+    :param refresh: the OCIDs have stale tags cached, which a failed look-up keeps
+    :return: dictionary of {target_ocid: Future of a {target_ocid: tags} dictionary}
+    """
+
+    futures = {}
+    batches = []
+
+    # a value that is not an OCID would break the query of its whole batch
+
+    invalid_lookups = [(target_ocid_key, target_ocid) for target_ocid_key, target_ocid in lookups
+                       if not ocid_pattern.fullmatch(target_ocid)]
+
+    if invalid_lookups:
+        logging.warning(f'not an ocid / not searched / {[target_ocid for _, target_ocid in invalid_lookups]}')
+        future = Future()
+        future.set_result(cache_ocid_tags(invalid_lookups, {target_ocid: None for _, target_ocid in invalid_lookups}))
+        futures.update((target_ocid, future) for _, target_ocid in invalid_lookups)
+        lookups = [lookup for lookup in lookups if lookup[1] not in futures]
+        with tag_cache_lock:
+            tag_cache_stats['invalid_ocids'] += len(invalid_lookups)
+
+    with tag_cache_lock:
+        new_lookups = []
+        for target_ocid_key, target_ocid in lookups:
+            future, in_flight_refresh = tag_lookups_in_flight.get(target_ocid, (None, False))
+            if future is None or (in_flight_refresh and not refresh):
+                new_lookups.append((target_ocid_key, target_ocid))
+            else:
+                futures[target_ocid] = future
+                tag_cache_stats['coalesced'] += 1
+
+        for batch in batch_lookups(new_lookups):
+            future = Future()
+            for _, target_ocid in batch:
+                tag_lookups_in_flight[target_ocid] = (future, refresh)
+                futures[target_ocid] = future
+            batches.append((batch, future))
+
+    for batch, future in batches:
+        logging.debug(f'looking up / {[target_ocid for _, target_ocid in batch]}')
+        if executor is None:
+            finish_tag_lookup(batch, future, refresh)
+        else:
+            executor.submit(finish_tag_lookup, batch, future, refresh)
+
+    return futures
+
+
+def finish_tag_lookup(lookups: list, future, refresh: bool = False):
+    """
+    Searches for a batch started by start_tag_lookups, caches the outcome and resolves its future.  When the
+    search fails, a refresh resolves to the stale tags still cached, as does a refresh past the refresh deadline,
+    without searching.  Otherwise, with tag_cache_error_backoff_seconds set, the OCIDs are cached as error entries
+    and resolve to empty tags; without it the future raises the error.
+    """
+
+    error = None
+    deadline = tag_refresh_state['deadline']
+    dropped = refresh and deadline is not None and time.monotonic() > deadline
+
+    try:
+        if dropped:
+            ocid_tags = stale_ocid_tags(lookups)
+        else:
+            ocid_tags = cache_ocid_tags(lookups, retrieve_ocids_tags(lookups))
+
+    except Exception as ex:
+        error = ex
+        ocid_tags = stale_ocid_tags(lookups) if refresh else cache_lookup_errors(lookups, ex)
+
+    with tag_cache_lock:
+        if dropped:
+            tag_cache_stats['refreshes_dropped'] += len(lookups)
+        elif refresh:
+            tag_cache_stats['refreshes' if error is None else 'refresh_failures'] += len(lookups)
+        for _, target_ocid in lookups:
+            if tag_lookups_in_flight.get(target_ocid, (None,))[0] is future:
+                del tag_lookups_in_flight[target_ocid]
+
+    if ocid_tags is None:
+        future.set_exception(error)
     else:
-        tag_collection = assemble_event_tags(payload)
-        position_tags_on_event(payload, tag_collection)
+        future.set_result(ocid_tags)
+
+
+def lookup_cached_tags(target_ocid: str, target_ocid_key: str = None):
+    """
+    Counted tag cache look-up.  An entry past its expiry is returned as stale for another
+    tag_cache_stale_seconds and dropped after that.  Error entries are not used past their backoff, but are
+    kept so that the next failure backs off longer.  Warmed-up entries have no target ocid key yet and take
+    the first one they are looked up with.
+    :return: tuple of (tags or None, stale flag)
+    """
+
+    with tag_cache_lock:
+        entry = tag_cache.get(target_ocid)
+        if entry is None:
+            tag_cache_stats['misses'] += 1
+            return None, False
+
+        tags, _, expires_at, _, kind, _ = entry
+        now = time.monotonic()
+        is_stale = now >= expires_at
+
+        if is_stale and (kind == 'error' or now >= expires_at + tag_cache_stale_seconds):
+            if kind != 'error':
+                tag_cache_state['bytes'] -= tag_cache.pop(target_ocid)[3]
+            tag_cache_stats['expirations'] += 1
+            tag_cache_stats['misses'] += 1
+            return None, False
+
+        if entry[1] is None and target_ocid_key is not None:
+            if tags:
+                tags = dict(tags)
+                tags['key'] = target_ocid_key
+            tag_cache[target_ocid] = (tags, target_ocid_key) + entry[2:]
+
+        tag_cache.move_to_end(target_ocid)
+        if is_stale:
+            tag_cache_stats['stale_hits'] += 1
+        else:
+            tag_cache_stats['hits' if kind == 'tags' else f'{kind}_hits'] += 1
+        return tags, is_stale
+
+
+def cache_ocid_tags(lookups: list, ocid_tags: dict):
+    """
+    Caches looked-up tags for tag_cache_ttl_seconds, and OCIDs the search found nothing for as negative entries
+    for tag_cache_negative_ttl_seconds.
+    :param lookups: the (target_ocid_key, target_ocid) lookups 'ocid_tags' answers
+    :param ocid_tags: dictionary of {target_ocid: tags, or None if not found}
+    :return: dictionary of {target_ocid: tags}, with empty tags for the OCIDs not found
+    """
+
+    now = time.monotonic()
+    entries = []
+    for target_ocid_key, target_ocid in lookups:
+        tags = ocid_tags[target_ocid]
+        kind, ttl_seconds = ('negative', tag_cache_negative_ttl_seconds) if tags is None \
+            else ('tags', tag_cache_ttl_seconds)
+        tags = {} if tags is None else tags
+        entries.append((target_ocid, (tags, target_ocid_key, now + ttl_seconds if ttl_seconds > 0 else math.inf,
+                                      len(target_ocid) + len(json.dumps(tags)), kind, 0)))
+
+    store_cache_entries(entries)
+    return {target_ocid: entry[0] for target_ocid, entry in entries}
+
+
+def cache_lookup_errors(lookups: list, error: Exception):
+    """
+    Caches the OCIDs of a failed look-up as error entries holding empty tags, so that they are not searched
+    again for tag_cache_error_backoff_seconds, doubled with every consecutive failure up to
+    tag_cache_error_backoff_max_seconds.
+    :return: dictionary of {target_ocid: empty tags}, or None if error backoff is disabled
+    """
+
+    with tag_cache_lock:
+        tag_cache_stats['lookup_failures'] += len(lookups)
+
+    if tag_cache_error_backoff_seconds <= 0:
+        return None
+
+    now = time.monotonic()
+    entries = []
+    with tag_cache_lock:
+        for target_ocid_key, target_ocid in lookups:
+            previous = tag_cache.get(target_ocid)
+            failures = previous[5] + 1 if previous is not None and previous[4] == 'error' else 1
+            backoff_seconds = min(tag_cache_error_backoff_seconds * 2 ** (failures - 1),
+                                  max(tag_cache_error_backoff_seconds, tag_cache_error_backoff_max_seconds))
+            entries.append((target_ocid, ({}, target_ocid_key, now + backoff_seconds, len(target_ocid) + 2, 'error',
+                                          failures)))
+
+    logging.error(f'tag lookup failed / backing off / {[target_ocid for _, target_ocid in lookups]} / {error}')
+    store_cache_entries(entries)
+    return {target_ocid: entry[0] for target_ocid, entry in entries}
+
+
+def stale_ocid_tags(lookups: list):
+    """
+    :return: dictionary of {target_ocid: tags} of the stale tags still cached for a failed refresh
+    """
+
+    with tag_cache_lock:
+        return {target_ocid: tag_cache[target_ocid][0] if target_ocid in tag_cache else {}
+                for _, target_ocid in lookups}
+
+
+def store_cache_entries(entries: list):
+    """
+    Stores (target_ocid, entry) pairs as the most recently used, then evicts the least recently used entries
+    until the cache is within tag_cache_max_entries and tag_cache_max_bytes.  The newest entry is always kept.
+    """
+
+    with tag_cache_lock:
+        for target_ocid, entry in entries:
+            previous = tag_cache.pop(target_ocid, None)
+            if previous is not None:
+                tag_cache_state['bytes'] -= previous[3]
+            tag_cache[target_ocid] = entry
+            tag_cache_state['bytes'] += entry[3]
+            tag_cache_state['changes'] += 1
+
+        while len(tag_cache) > 1 and (0 < tag_cache_max_entries < len(tag_cache)
+                                      or 0 < tag_cache_max_bytes < tag_cache_state['bytes']):
+            tag_cache_state['bytes'] -= tag_cache.popitem(last=False)[1][3]
+            tag_cache_stats['evictions'] += 1
+
+
+def refresh_stale_tags(lookups: list):
+    """
+    Looks up stale OCIDs again on the search threads; the stale tags stay in use until then.  A failed refresh
+    leaves the stale entry to expire.
+    :param lookups: list of (target_ocid_key, target_ocid) tuples
+    """
+
+    futures = start_tag_lookups(lookups, get_search_executor(), refresh=True)
+
+    with tag_cache_lock:
+        tag_refresh_state['futures'].update(futures.values())
+
+
+def finish_tag_refreshes():
+    """
+    Waits up to tag_cache_refresh_wait_seconds for the refreshes started during the invocation, so that none is
+    left running when Fn freezes the container.  Refreshes that have not started by the deadline are dropped,
+    see finish_tag_lookup.
+    """
+
+    with tag_cache_lock:
+        futures = tag_refresh_state['futures']
+        if not futures:
+            return
+        tag_refresh_state['futures'] = set()
+        tag_refresh_state['deadline'] = time.monotonic() + tag_cache_refresh_wait_seconds
+
+    try:
+        wait(futures)
+    finally:
+        tag_refresh_state['deadline'] = None
+
+
+def initialize_tag_cache():
+    """
+    Runs on the container's first invocation: loads the tag snapshot, or else warms the cache up from
+    tag_warmup_compartments and writes the snapshot.  Neither fails the invocation.
+    """
+
+    if tag_cache_state['initialized']:
+        return
+
+    tag_cache_state['initialized'] = True
+
+    if tag_snapshot_path and load_tag_snapshot() > 0:
+        return
+
+    if tag_warmup_compartments:
+        warm_up_tag_cache()
+        save_tag_snapshot(force=True)
+
+
+def warm_up_tag_cache():
+    """
+    Caches the tags of every resource in tag_warmup_compartments with one paged search per compartment and
+    tag_warmup_types type, up to tag_search_max_workers searches at a time.  The entries take their target
+    ocid key when first used.
+    :return: number of resources cached
+    """
+
+    compartments = [compartment.strip() for compartment in tag_warmup_compartments]
+    resource_types = [resource_type.strip() for resource_type in tag_warmup_types]
+
+    for name, values, pattern in [('compartment', compartments, ocid_pattern),
+                                  ('resource type', resource_types, resource_type_pattern)]:
+        invalid = [value for value in values if not pattern.fullmatch(value)]
+        if invalid:
+            logging.warning(f'tag warm-up / not a valid {name} / skipped / {invalid}')
+            values[:] = [value for value in values if value not in invalid]
+
+    queries = [f"query {resource_type} resources where compartmentId = '{compartment}'"
+               for resource_type in resource_types for compartment in compartments]
+    start = time.perf_counter()
+
+    cached = sum(get_search_executor().map(warm_up_query, queries))
+
+    logging.info(f'tag warm-up / queries {len(queries)} / resources {cached} / '
+                 f'seconds {time.perf_counter() - start:.3f}')
+    return cached
+
+
+def warm_up_query(query: str):
+    """
+    Caches the tags of the resources a warm-up query finds, at most tag_cache_max_entries of them.
+    :return: number of resources cached
+    """
+
+    entries = []
+    expires_at = time.monotonic() + tag_cache_ttl_seconds if tag_cache_ttl_seconds > 0 else math.inf
+
+    try:
+        for resource_summary in search_resource_pages(query):
+            tags = {}
+            collect_resource_tags(tags, None, resource_summary)
+            entries.append((resource_summary.identifier,
+                            (tags, None, expires_at, len(resource_summary.identifier) + len(json.dumps(tags)),
+                             'tags', 0)))
+            if 0 < tag_cache_max_entries <= len(entries):
+                break
+
+    except Exception as ex:
+        logging.error(f'tag warm-up failed / {query} / {ex}')
+
+    store_cache_entries(entries)
+    return len(entries)
+
+
+def save_tag_snapshot(force: bool = False):
+    """
+    Writes the tag and negative cache entries, least recently used first, to tag_snapshot_path if the cache
+    changed and tag_snapshot_interval_seconds have passed since the last write (or 'force').  The file is
+    written next to the snapshot and renamed over it, so readers never see a partial snapshot.
+    Snapshot format: {"version": 1, "written_at": epoch seconds,
+    "entries": [[target_ocid, target_ocid_key, kind, expires at epoch seconds or null, size, tags], ...]}
+    """
+
+    if not tag_snapshot_path or tag_cache_state['changes'] == tag_cache_state['snapshot_changes']:
+        return
+
+    if not force and time.monotonic() - tag_cache_state['snapshot_at'] < tag_snapshot_interval_seconds:
+        return
+
+    try:
+        with tag_cache_lock:
+            now, wall_now = time.monotonic(), time.time()
+            changes = tag_cache_state['changes']
+            entries = [[target_ocid, target_ocid_key, kind,
+                        None if expires_at == math.inf else wall_now + expires_at - now, size, tags]
+                       for target_ocid, (tags, target_ocid_key, expires_at, size, kind, _) in tag_cache.items()
+                       if kind != 'error' and expires_at > now]
+
+        snapshot = json.dumps({'version': 1, 'written_at': wall_now, 'entries': entries},
+                              separators=(',', ':')).encode()
+        if tag_snapshot_path.endswith('.gz'):
+            snapshot = gzip.compress(snapshot, compresslevel=1)
+
+        directory = os.path.dirname(tag_snapshot_path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=directory, prefix=os.path.basename(tag_snapshot_path) + '.',
+                                         delete=False) as snapshot_file:
+            snapshot_file.write(snapshot)
+        os.replace(snapshot_file.name, tag_snapshot_path)
+
+        tag_cache_state['snapshot_changes'] = changes
+        tag_cache_state['snapshot_at'] = time.monotonic()
+        logging.info(f'tag snapshot / written / entries {len(entries)} / bytes {len(snapshot)}')
+
+    except Exception as ex:
+        logging.warning(f'tag snapshot / write failed / {tag_snapshot_path} / {ex}')
+
+
+def load_tag_snapshot():
+    """
+    Loads the unexpired entries of the tag_snapshot_path snapshot written by save_tag_snapshot.
+    :return: number of entries loaded, 0 if there is no usable snapshot
+    """
+
+    try:
+        with open(tag_snapshot_path, 'rb') as snapshot_file:
+            snapshot = snapshot_file.read()
+
+    except FileNotFoundError:
+        return 0
+
+    try:
+        if snapshot[:2] == b'\x1f\x8b':
+            snapshot = gzip.decompress(snapshot)
+        snapshot = json.loads(snapshot)
+        if snapshot.get('version') != 1:
+            raise ValueError(f'unsupported version {snapshot.get("version")}')
+
+        now, wall_now = time.monotonic(), time.time()
+        entries = [(target_ocid, (tags, target_ocid_key,
+                                  math.inf if expires_at is None else now + expires_at - wall_now, size, kind, 0))
+                   for target_ocid, target_ocid_key, kind, expires_at, size, tags in snapshot['entries']
+                   if expires_at is None or expires_at > wall_now]
+
+    except Exception as ex:
+        logging.warning(f'tag snapshot / unusable / {tag_snapshot_path} / {ex}')
+        return 0
+
+    store_cache_entries(entries)
+    tag_cache_state['snapshot_changes'] = tag_cache_state['changes']
+    logging.info(f'tag snapshot / loaded / entries {len(entries)} / age {wall_now - snapshot["written_at"]:.0f} s')
+    return len(entries)
 
 
 def position_tags_on_event(event, tag_collection: list):
@@ -157,20 +858,26 @@ def position_tags_on_event(event, tag_collection: list):
     event[tag_assembly_key] = tag_collection
 
 
-def assemble_event_tags(event: dict):
+def assemble_event_tags(event: dict, target_ocids: dict = None, ocid_tags: dict = None):
     """
     Collects tags for each of the target ocids.
     :param event: dictionary of the task's event.
+    :param target_ocids: the event's target ocids if already found with get_dictionary_values
+    :param ocid_tags: tags of the event's ocids if already found with prefetch_ocid_tags
     :return: a dictionary of the assembled tags.  A dictionary makes it possible to support collection and
     return of tags for multiple ocids.
     """
 
-    global tag_cache
     combined_tags = []
 
+    # one pass over the event finds all the target ocids
+
+    if target_ocids is None:
+        target_ocids = get_dictionary_values(event, target_ocid_keys)
+
     for target_ocid_key in target_ocid_keys:
 
-        target_ocid = get_dictionary_value(event, target_ocid_key)
+        target_ocid = target_ocids.get(target_ocid_key)
         logging.debug(f'target_ocid / {target_ocid_key} / {target_ocid}')
 
         if target_ocid is None:
@@ -184,15 +891,20 @@ def assemble_event_tags(event: dict):
             logging.error(f'event / {event}')
             continue
 
-        cached_tags = tag_cache.get(target_ocid)
+        if ocid_tags is not None and target_ocid in ocid_tags:
+            combined_tags.append(ocid_tags[target_ocid])
+            continue
+
+        cached_tags, is_stale = lookup_cached_tags(target_ocid, target_ocid_key)
         if cached_tags is not None:
             logging.debug(f'using cache / {target_ocid} / {cached_tags}')
             combined_tags.append(cached_tags)
+            if is_stale:
+                refresh_stale_tags([(target_ocid_key, target_ocid)])
             continue
 
-        ocid_tags = retrieve_ocid_tags(target_ocid_key, target_ocid)
-        combined_tags.append(ocid_tags)
-        tag_cache[target_ocid] = ocid_tags
+        future = start_tag_lookups([(target_ocid_key, target_ocid)])[target_ocid]
+        combined_tags.append(future.result()[target_ocid])
 
     logging.debug(f'combined_tags / {combined_tags}')
     return combined_tags
@@ -206,43 +918,136 @@ def retrieve_ocid_tags(target_ocid_key, target_ocid):
     :return: list of extracted tags for the given ocid including a kv pair for target_ocid_key:target_ocid
     """
 
-    tag_object = {}
     if target_ocid is None:
-        return tag_object
+        return {}
+
+    return retrieve_ocids_tags([(target_ocid_key, target_ocid)])[target_ocid] or {}
+
+
+def retrieve_ocids_tags(lookups: list):
+    """
+    Searches for several ocids with one structured query (one identifier clause per ocid, OR'ed) and follows
+    the result pages.  Resource summaries are routed back to their ocid by identifier.
+    :param lookups: list of (target_ocid_key, target_ocid) tuples
+    :return: dictionary of {target_ocid: tag object}.  The tag object is None if nothing was found.
+    """
+
+    target_ocid_keys_by_ocid = {target_ocid: target_ocid_key for target_ocid_key, target_ocid in lookups}
+    tag_objects = {target_ocid: {} for target_ocid in target_ocid_keys_by_ocid}
+    found_ocids = set()
+
+    logging.debug(f'searching / {list(tag_objects)}')
+    query = 'query all resources where ' + ' || '.join(f"identifier = '{target_ocid}'" for target_ocid in tag_objects)
+
+    for resource_summary in search_resource_pages(query):
+
+        tag_object = tag_objects.get(resource_summary.identifier)
+        if tag_object is None:
+            logging.warning(f'search result not requested / {resource_summary.identifier}')
+            continue
+
+        logging.debug(f'resource_summary / {resource_summary}')
+        found_ocids.add(resource_summary.identifier)
+        collect_resource_tags(tag_object, target_ocid_keys_by_ocid[resource_summary.identifier], resource_summary)
+
+    logging.debug(f'tags retrieved / {tag_objects}')
+    return {target_ocid: tag_object if target_ocid in found_ocids else None
+            for target_ocid, tag_object in tag_objects.items()}
+
+
+def search_resource_pages(query: str):
+    """
+    Runs a structured Search query, following the result pages.
+    :return: generator of the resource summaries found
+    """
 
-    logging.debug(f'searching / {target_ocid}')
     structured_search = oci.resource_search.models.StructuredSearchDetails(
-            query="query all resources where identifier = '{}'".format(target_ocid),
+            query=query,
             matching_context_type=oci.resource_search.models.SearchDetails.MATCHING_CONTEXT_TYPE_NONE,
             type='Structured')
 
-    search_response = search_client.search_resources(structured_search)
-    # logging.debug(f'search_response.data / {search_response.data}')
+    page = None
+    while True:
+        wait_for_search_rate_limit()
+        search_response = get_search_client().search_resources(structured_search, **({'page': page} if page else {}))
+        # logging.debug(f'search_response.data / {search_response.data}')
+
+        if hasattr(search_response, 'data'):
+            yield from search_response.data.items
+
+        page = getattr(search_response, 'next_page', None)
+        if not page:
+            break
 
-    if hasattr(search_response, 'data'):
 
-        resource_summary_collection = search_response.data
-        for resource_summary in resource_summary_collection.items:
+def collect_resource_tags(tag_object: dict, target_ocid_key, resource_summary):
+    """
+    Adds the resource summary's tags to the ocid's tag object.
+    """
 
-            if target_ocid != resource_summary.identifier:
-                raise Exception(f'identifier mismatch / {target_ocid} / {resource_summary.identifier}')
+    collect_tags(tag_object, 'freeform', include_freeform_tags, resource_summary.freeform_tags)
+    collect_tags(tag_object, 'defined', include_defined_tags, resource_summary.defined_tags)
+    collect_tags(tag_object, 'system', include_system_tags, resource_summary.system_tags)
 
-            logging.debug(f'resource_summary / {resource_summary}')
+    # if collect_tags returned any tags, also set the key, ocid and resource type in the
+    # tag object for easier programmatic access downstream.
 
-            collect_tags(tag_object, 'freeform', include_freeform_tags, resource_summary.freeform_tags)
-            collect_tags(tag_object, 'defined', include_defined_tags, resource_summary.defined_tags)
-            collect_tags(tag_object, 'system', include_system_tags, resource_summary.system_tags)
+    if tag_object:
+        tag_object['key'] = target_ocid_key
+        tag_object['identifier'] = resource_summary.identifier
+        # tag_object['resource_type'] = resource_summary.resource_type
 
-            # if collect_tags returned any tags, also set the key, ocid and resource type in the
-            # tag object for easier programmatic access downstream.
 
-            if tag_object:
-                tag_object['key'] = target_ocid_key
-                tag_object['identifier'] = resource_summary.identifier
-                # tag_object['resource_type'] = resource_summary.resource_type
+def get_search_executor():
+    """
+    :return: the search executor, created on first use
+    """
+
+    global search_executor
+
+    with search_executor_lock:
+        if search_executor is None:
+            search_executor = ThreadPoolExecutor(max_workers=max(1, tag_search_max_workers),
+                                                 thread_name_prefix='tag-search')
+
+    return search_executor
+
+
+def get_search_client():
+    """
+    Search clients are created on first use, one per thread, and share the resource principals signer.
+    Creating them lazily also lets the module load outside of OCI Functions.
+    """
 
-    logging.debug(f'tags retrieved / {target_ocid_key} / {target_ocid} / {tag_object}')
-    return tag_object
+    global signer
+
+    search_client = getattr(search_clients, 'client', None)
+    if search_client is None:
+        with signer_lock:
+            if signer is None:
+                signer = oci.auth.signers.get_resource_principals_signer()
+
+        search_client = oci.resource_search.ResourceSearchClient(config={}, signer=signer)
+        search_clients.client = search_client
+
+    return search_client
+
+
+def wait_for_search_rate_limit():
+    """
+    Spaces Search API requests at least 1 / tag_search_rate_limit seconds apart across threads.
+    """
+
+    if tag_search_rate_limit <= 0:
+        return
+
+    with search_rate_lock:
+        now = time.monotonic()
+        request_time = max(now, search_rate_state['next_request'])
+        search_rate_state['next_request'] = request_time + 1 / tag_search_rate_limit
+
+    if request_time > now:
+        time.sleep(request_time - now)
 
 
 def collect_tags(dictionary, tag_type_key, inclusion_flag, results):
@@ -290,3 +1095,45 @@ def get_dictionary_value(dictionary: dict, target_key: str):
                     target_value = get_dictionary_value(dictionary=entry, target_key=target_key)
                     if target_value is not None:
                         return target_value
+
+
+def get_dictionary_values(dictionary: dict, target_keys: list, found: dict = None):
+    """
+    Single-pass version of get_dictionary_value for several keys.  A key on the current dictionary wins over
+    nested ones and nested dictionaries / lists are visited in order, so each key gets the same first match
+    get_dictionary_value would return.  The walk stops as soon as every key has been found.
+    :param dictionary: the dictionary to scan
+    :param target_keys: the keys we are looking for
+    :return: dictionary of {target_key: first value found} for the keys found
+    """
+
+    if dictionary is None:
+        raise Exception(f'dictionary is None / {target_keys}')
+
+    if found is None:
+        found = {}
+        target_keys = list(dict.fromkeys(target_keys))
+
+    for target_key in target_keys:
+        if target_key not in found:
+            target_value = dictionary.get(target_key)
+            if target_value is not None:
+                found[target_key] = target_value
+
+    if len(found) == len(target_keys):
+        return found
+
+    for key, value in dictionary.items():
+        if isinstance(value, dict):
+            get_dictionary_values(dictionary=value, target_keys=target_keys, found=found)
+            if len(found) == len(target_keys):
+                return found
+
+        elif isinstance(value, list):
+            for entry in value:
+                if isinstance(entry, dict):
+                    get_dictionary_values(dictionary=entry, target_keys=target_keys, found=found)
+                    if len(found) == len(target_keys):
+                        return found
+
+    return found